@@ -0,0 +1,227 @@
+import os, json, time, hashlib, inspect, functools, threading
+from models import BusStop, RouteGeometry
+
+# 버스 API 응답을 cache/api 아래에 JSON 파일로 저장하는 캐시
+# 키는 제공자 + 엔드포인트 + 인자(서비스 키 제외)의 sha256
+
+cache_dir = os.path.join('cache', 'api')
+enabled = True
+
+# 캐시 전체 크기 상한 (넘으면 가장 오래 쓰지 않은 항목부터 삭제)
+# 정리할 때는 상한의 prune_ratio까지 줄여서 상한 근처에서 매번 정리하지 않도록 함
+max_size = 64 * 1024 * 1024
+prune_ratio = 0.9
+
+day = 24 * 60 * 60
+default_ttl = day
+ttls = {
+    'bus_stops': 7 * day,
+    'bus_route': 7 * day,
+    'bus_type': 7 * day,
+    'route_stops': 7 * day,
+    'search': day,
+}
+
+# 빈 결과(검색 결과 없음 등)를 보관하는 시간 (새로 생긴 노선이 너무 오래 가려지지 않도록 짧게)
+empty_ttl = 60 * 60
+
+# 캐시 키에서 제외할 인자 (서비스 키)
+excluded_args = ('key',)
+
+# 저장 형식이 바뀌면 올려서 이전 항목을 무시함
+format_version = 2
+
+# to_dict/from_dict로 저장하는 형식
+record_types = {cls.__name__: cls for cls in (BusStop, RouteGeometry)}
+
+_lock = threading.Lock()
+# 캐시 파일 크기의 합 (처음 저장할 때 폴더를 한 번 훑어서 구하고, 이후에는 저장과 삭제 때 갱신)
+_total_size = None
+
+class DoNotCache(Exception):
+    # 캐시할 함수에서 발생시키면 value를 그대로 반환하되 저장하지 않음
+    # (응답 오류 등으로 빈 결과를 반환하지만 다음에 다시 요청해야 하는 경우)
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+def encode(value):
+    # JSON에는 튜플이 없으므로 표시해서 저장 (정류장 좌표 등)
+    # 정류장, 노선형상 객체는 형식 이름과 to_dict 결과로 저장
+    if isinstance(value, (BusStop, RouteGeometry)):
+        return {'__type__': type(value).__name__, 'value': encode(value.to_dict())}
+    elif isinstance(value, tuple):
+        return {'__tuple__': [encode(x) for x in value]}
+    elif isinstance(value, list):
+        return [encode(x) for x in value]
+    elif isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    return value
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(x) for x in value]
+    elif isinstance(value, dict):
+        if len(value) == 1 and '__tuple__' in value:
+            return tuple(decode(x) for x in value['__tuple__'])
+        if len(value) == 2 and '__type__' in value:
+            return record_types[value['__type__']].from_dict(decode(value['value']))
+        return {k: decode(v) for k, v in value.items()}
+    return value
+
+def is_empty(value):
+    # 빈 결과는 empty_ttl 동안만 사용함
+    if value is None:
+        return True
+    if isinstance(value, tuple):
+        return all(is_empty(x) for x in value)
+    if isinstance(value, (list, dict, str, RouteGeometry)):
+        return len(value) == 0
+    return False
+
+def cache_key(provider, endpoint, args):
+    text = json.dumps([format_version, provider, endpoint, encode(args)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def cache_path(digest):
+    return os.path.join(cache_dir, digest + '.json')
+
+def get_ttl(endpoint):
+    return ttls.get(endpoint, default_ttl)
+
+def load(digest, ttl):
+    path = cache_path(digest)
+    
+    try:
+        with open(path, mode='r', encoding='utf-8') as cache_file:
+            entry = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return False, None
+    
+    if entry.get('empty'):
+        ttl = min(ttl, empty_ttl)
+    
+    if time.time() - entry.get('time', 0) > ttl:
+        return False, None
+    
+    # 파일 수정 시각을 LRU 순서로 사용
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    
+    return True, decode(entry['value'])
+
+def scan():
+    # [(수정 시각, 크기, 파일 이름), ...]
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return []
+    
+    entries = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    
+    return entries
+
+def store(digest, value):
+    global _total_size
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(digest)
+    tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+    
+    with open(tmp_path, mode='w', encoding='utf-8') as cache_file:
+        json.dump({'time': time.time(), 'value': encode(value), 'empty': is_empty(value)}, cache_file, ensure_ascii=False)
+    size = os.path.getsize(tmp_path)
+    
+    with _lock:
+        if _total_size is None:
+            _total_size = sum(entry[1] for entry in scan())
+        
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        
+        os.replace(tmp_path, path)
+        _total_size += size - old_size
+        
+        is_full = _total_size > max_size
+    
+    # 폴더를 훑는 정리는 상한을 넘었을 때만 함
+    if is_full:
+        prune(int(max_size * prune_ratio))
+
+def prune(limit=None):
+    global _total_size
+    
+    if limit is None:
+        limit = max_size
+    
+    with _lock:
+        entries = scan()
+        total = sum(entry[1] for entry in entries)
+        
+        entries.sort()
+        for _, size, name in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+        
+        _total_size = total
+
+def clear():
+    prune(0)
+
+def cached(provider, endpoint):
+    # 함수 결과를 캐시하는 데코레이터
+    # 호출 시 use_cache=False를 주면 캐시를 읽지 않고 새로 받아 저장함
+    # 빈 결과도 저장하고, 예외(DoNotCache 포함)로 끝난 호출은 저장하지 않음
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @functools.wraps(func)
+        def wrapper(*args, use_cache=True, **kwargs):
+            if not enabled:
+                try:
+                    return func(*args, **kwargs)
+                except DoNotCache as e:
+                    return e.value
+            
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key_args = {k: v for k, v in bound.arguments.items() if k not in excluded_args}
+            digest = cache_key(provider, endpoint, key_args)
+            
+            if use_cache:
+                hit, value = load(digest, get_ttl(endpoint))
+                if hit:
+                    return value
+            
+            try:
+                value = func(*args, **kwargs)
+            except DoNotCache as e:
+                return e.value
+            
+            try:
+                store(digest, value)
+            except OSError:
+                pass
+            
+            return value
+        
+        return wrapper
+    
+    return decorator
@@ -1 +1 @@
-pyinstaller -F gui.py -i resources/icon.ico --add-data="resources/icon.ico;./resources" --add-data="resources/down-arrow.svg;./resources" --add-data="styles/singapore-mrt.svg;./styles" --add-data="styles/singapore-mrt-dark.svg;./styles" -w -n bus_routemap.exe
\ No newline at end of file
+pyinstaller -F gui.py -i resources/icon.ico --add-data="resources/icon.ico;./resources" --add-data="resources/down-arrow.svg;./resources" --add-data="resources/tago_cities.json;./resources" --add-data="styles/singapore-mrt.svg;./styles" --add-data="styles/singapore-mrt-dark.svg;./styles" -w -n bus_routemap.exe
\ No newline at end of file
@@ -1,9 +1,14 @@
 import xml.etree.ElementTree as elemtree
 from datetime import datetime
-import requests, time, sys, os, re, math, json, base64, urllib, io
-import mapbox
+import requests, time, sys, os, re, math, json, base64, urllib, io, threading, shutil
+import mapbox, http_client, api_cache
+from xml_records import parse_records
+from models import BusStop, RouteGeometry
+from city_catalog import CityCatalog
+from route_catalog import RouteCatalog
+from tile_store import TileStore
 from routemap import convert_gps, convert_pos, Mapframe, RouteMap
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 class ApiKeyError(Exception):
     pass
@@ -24,12 +29,46 @@ class BusanApiKeyError(ApiKeyError):
 class TagoApiKeyError(ApiKeyError):
     pass
 
+class RouteLoadCancelled(Exception):
+    pass
+
+class SearchError(Exception):
+    # 통합 검색에서 제공자별로 발생한 오류 모음 (errors: 제공자 -> 예외)
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(' / '.join(str(e) for e in errors.values()))
+
 route_type_str = {0: '공용', 1: '공항', 2: '마을', 3: '간선', 4: '지선', 5: '순환', 6: '광역', 7: '인천', 8: '경기', 9: '폐지', 10: '투어',
     11: '직행', 12: '좌석', 13: '일반', 14: '광역', 15: '따복', 16: '순환', 21: '농어촌직행', 22: '농어촌좌석', 23: '농어촌', 30: '마을', 
     41: '고속', 42: '시외좌석', 43: '시외일반', 51: '공항리무진', 52: '공항좌석', 53: '공항일반',
     61: '일반', 62: '급행', 63: '좌석', 64: '심야', 65: '마을'}
 
 cache_dir = 'cache'
+mapbox_max_workers = 8
+# 배경 지도 타일을 mapframe으로 자를 때 더 남기는 여백 (타일 좌표 4096 기준, 선 두께가 잘리지 않도록)
+mapbox_clip_margin = 256
+# 타일 클립 마스크 (mapbox.render_tile의 map-clip-mask와 같은 영역, 타일 좌표)
+# clipPath는 뒤집는 transform이 적용된 <g>에서 참조하므로 마스크의 rect가 그대로 타일 좌표(y축 위쪽)임
+# (오른쪽과 위쪽으로 16만큼 더 그려 옆 타일과의 틈을 메움)
+mapbox_tile_mask_rect = (0, 0, 4112, 4112)
+# 배경 지도 도형을 단순화하는 허용 오차 (출력 픽셀 단위, 0이면 단순화하지 않음)
+mapbox_simplify_pixels = 0.5
+
+# 배경 지도 타일 저장소 (타일셋별 벡터 타일과 스타일별로 렌더링한 SVG 조각)
+# 전체 크기가 tile_cache_max_size를 넘으면 오래 쓰지 않은 타일부터 지움
+tile_cache_max_size = 512 * 1024 * 1024
+tile_store = TileStore(os.path.join(cache_dir, 'tiles.db'), max_size=tile_cache_max_size)
+# 디코딩한 벡터 타일을 메모리에 보관하는 최대 개수 (테마를 바꾸거나 가장자리 타일을 다시 그릴 때 디코딩을 생략)
+decoded_tile_cache_size = 64
+decoded_tile_cache = {}
+decoded_tile_cache_lock = threading.Lock()
+
+# 통합 검색에서 제공자별로 기다리는 최대 시간 (초, 검색 시작 시점부터)
+search_timeouts = {'seoul': 10, 'gyeonggi': 10, 'busan': 15, 'tago': 20}
+search_provider_names = {'seoul': '서울', 'gyeonggi': '경기', 'busan': '부산', 'tago': 'TAGO'}
+# 검색 취소 여부를 확인하는 간격 (초)
+search_cancel_interval = 0.1
+tago_page_max_workers = 4
 
 def convert_busan_bus_type(type_str):
     if type_str[:2] == '일반':
@@ -97,7 +136,7 @@ def convert_type_to_region(route_type, route_id=None):
 def check_seoul_key_valid(key):
     params = {'serviceKey': key}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -108,7 +147,7 @@ def check_seoul_key_valid(key):
 
 def check_gyeonggi_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
 
     if route_api_res.headers.get('Content-Type').startswith('text/xml'):
         route_api_tree = elemtree.fromstring(route_api_res.text)
@@ -121,7 +160,7 @@ def check_gyeonggi_key_valid(key):
 
 def check_busan_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params, timeout = 20).text
+    route_api_res = http_client.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params, timeout = 20).text
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -135,7 +174,7 @@ def check_tago_key_valid(key):
     params = {'serviceKey': key, 'cityCode': '23', 'routeNo': '1', '_type': 'xml'}
     
     try:
-        route_api_res = requests.get('http://apis.data.go.kr/1613000/BusRouteInfoInqireService/getBusRouteList', params = params, timeout = 20)
+        route_api_res = http_client.get('http://apis.data.go.kr/1613000/BusRouteInfoInqireService/getBusRouteList', params = params, timeout = 20)
 
         if route_api_res.headers.get('Content-Type').startswith('text/xml'):
             route_api_tree = elemtree.fromstring(route_api_res.text)
@@ -152,514 +191,430 @@ def check_tago_key_valid(key):
         return False
 
 # ... (기존 get_seoul_bus_stops, get_gyeonggi_bus_stops, get_busan_bus_stops 함수는 변경 없음) ...
+@api_cache.cached('seoul', 'bus_stops')
 def get_seoul_bus_stops(key, routeid):
     # 서울 버스 정류장 목록 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
-    route_api_tree = elemtree.fromstring(route_api_res)
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params)
+    route_api_records = parse_records(route_api_res, 'itemList', ['msgHeader/headerCd', 'msgHeader/headerMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
+    api_err = int(route_api_records.header['msgHeader/headerCd'])
     
     if api_err == 7:
         raise SeoulApiKeyError()
     
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/headerMsg').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    bus_stop_items = route_api_body.findall('./itemList')
+        raise ValueError(route_api_records.header.get('msgHeader/headerMsg'))
 
     bus_stops = []
-    for i in bus_stop_items:
-        stop = {}
-        stop['arsid'] = i.find('./arsId').text
-        stop['name'] = i.find('./stationNm').text
-        stop['pos'] = (float(i.find('./gpsX').text), float(i.find('./gpsY').text))
-        stop['is_trans'] = i.find('./transYn').text == 'Y'
+    for i in route_api_records.items:
+        stop = BusStop(i['arsId'], i['stationNm'], (float(i['gpsX']), float(i['gpsY'])), i['transYn'] == 'Y')
         
         bus_stops.append(stop)
     
     return bus_stops
 
+@api_cache.cached('gyeonggi', 'bus_stops')
 def get_gyeonggi_bus_stops(key, routeid):
     # 경기 버스 정류장 목록 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
-        return []
+        raise api_cache.DoNotCache([])
 
-    route_api_tree = elemtree.fromstring(route_api_res.text)
+    route_api_records = parse_records(route_api_res, 'busRouteStationList', ['cmmMsgHeader/returnAuthMsg', 'msgHeader/resultCode', 'msgHeader/resultMessage'])
     
-    api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise GyeonggiApiKeyError(api_common_err.text)
+    if 'cmmMsgHeader/returnAuthMsg' in route_api_records.header:
+        raise GyeonggiApiKeyError(route_api_records.header['cmmMsgHeader/returnAuthMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/resultCode').text)
+    api_err = int(route_api_records.header['msgHeader/resultCode'])
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/resultMessage').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    bus_stop_items = route_api_body.findall('./busRouteStationList')
+        raise ValueError(route_api_records.header.get('msgHeader/resultMessage'))
 
     bus_stops = []
-    for i in bus_stop_items:
-        stop = {}
-        
-        arsid_find = i.find('./mobileNo')
-        if arsid_find:
-            stop['arsid'] = arsid_find.text
-        else:
-            stop['arsid'] = None
-        
-        stop['name'] = i.find('./stationName').text
-        stop['pos'] = (float(i.find('./x').text), float(i.find('./y').text))
-        stop['is_trans'] = i.find('./turnYn').text == 'Y'
+    for i in route_api_records.items:
+        stop = BusStop(i.get('mobileNo'), i['stationName'], (float(i['x']), float(i['y'])), i['turnYn'] == 'Y')
         
         bus_stops.append(stop)
     
     return bus_stops
 
+@api_cache.cached('busan', 'bus_stops')
 def get_busan_bus_stops(key, route_id, route_bims_id):
     # 부산 버스 정류장 목록 조회
     params = {'optBusNum': route_bims_id}
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
-    route_api_tree = elemtree.fromstring(route_api_res)
-
-    bus_stop_items = route_api_tree.findall('./line')
+    route_api_res = http_client.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20)
+    bus_stop_items = parse_records(route_api_res, 'line').items
     
     bus_stops = []
     for i in bus_stop_items[2:]:
-        stop = {}
-        
-        stop['arsid'] = i.attrib['text4']
-        stop['name'] = i.attrib['text1']
-        stop['pos'] = (float(i.attrib['text2']), float(i.attrib['text3']))
-        stop['is_trans'] = False
+        stop = BusStop(i['text4'], i['text1'], (float(i['text2']), float(i['text3'])))
         
         bus_stops.append(stop)
     
     params2 = {'serviceKey': key, 'lineid': route_id}
-    route_api_res2 = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params2, timeout = 20).text
-    route_api_tree2 = elemtree.fromstring(route_api_res2)
+    route_api_res2 = http_client.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params2, timeout = 20)
+    route_api_records2 = parse_records(route_api_res2, 'item', ['cmmMsgHeader/returnAuthMsg'])
     
-    api_common_err = route_api_tree2.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise BusanApiKeyError(api_common_err.text)
+    if 'cmmMsgHeader/returnAuthMsg' in route_api_records2.header:
+        raise BusanApiKeyError(route_api_records2.header['cmmMsgHeader/returnAuthMsg'])
     
-    bus_stop_items2 = route_api_tree2.findall('./body/items/item')
-    for i in bus_stop_items2:
-        if i.find('./rpoint').text == '1':
-            bus_stops[int(i.find('./bstopidx').text) - 1]['is_trans'] = True
+    for i in route_api_records2.items:
+        if i.get('rpoint') == '1':
+            bus_stops[int(i['bstopidx']) - 1].is_trans = True
             break
     
     return bus_stops
 
-# [신규] TAGO API로 버스 정류장 목록 조회
-def get_tago_bus_stops(key, routeid, cityCode):
-    bus_stops = []
-    page_no = 1
-    num_of_rows = 100  # 충분히 크게 설정
-    
-    while True:
-        params = {
-            'serviceKey': key, 
-            'routeId': routeid, 
-            'cityCode': cityCode, 
-            'pageNo': page_no,
-            'numOfRows': num_of_rows,
-            '_type': 'xml'
-        }
-        
-        try:
-            route_api_res = requests.get(
-                'https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteAcctoThrghSttnList', 
-                params=params, 
-                timeout=20
-            )
-            
-            if not (route_api_res.headers.get('Content-Type', '').startswith('text/xml') or 
-                    route_api_res.headers.get('Content-Type', '').startswith('application/xml')):
-                break
-
-            route_api_tree = elemtree.fromstring(route_api_res.text)
-            
-            api_err_code = route_api_tree.find('./header/resultCode')
-            if api_err_code is None:
-                raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다.")
-            
-            if api_err_code.text == '03':  # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
-                raise TagoApiKeyError(route_api_tree.find('./header/resultMsg').text)
-
-            if api_err_code.text != '00':  # 00: 정상
-                if api_err_code.text == '04':  # NODATA_ERROR
-                    break
-                raise ValueError(route_api_tree.find('./header/resultMsg').text)
-
-            route_api_body = route_api_tree.find('./body/items')
-            if route_api_body is None:
-                break
-                
-            bus_stop_items = route_api_body.findall('./item')
-            
-            if not bus_stop_items:
-                break
+# [신규] TAGO API 목록 한 페이지 조회
+# (item 레코드 목록, totalCount)를 반환하며, 결과가 없으면 빈 목록을 반환
+# XML 응답이 아니면 (서버 오류 페이지 등) 오류를 발생시킴
+def get_tago_page(url, params, page_no, num_of_rows, timeout):
+    params = dict(params, pageNo=page_no, numOfRows=num_of_rows, _type='xml')
+    
+    api_res = http_client.get(url, params=params, timeout=timeout)
+    
+    if not (api_res.headers.get('Content-Type', '').startswith('text/xml') or 
+            api_res.headers.get('Content-Type', '').startswith('application/xml')):
+        raise ValueError('XML 응답이 아닙니다. ({})'.format(api_res.status_code))
+    
+    api_records = parse_records(api_res, 'item', ['header/resultCode', 'header/resultMsg', 'body/totalCount'])
+    
+    api_err_code = api_records.header.get('header/resultCode')
+    if api_err_code is None:
+        raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다.")
+    
+    if api_err_code == '03':  # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
+        raise TagoApiKeyError(api_records.header.get('header/resultMsg'))
+    
+    if api_err_code != '00':  # 00: 정상
+        if api_err_code == '04':  # NODATA_ERROR
+            return [], 0
+        raise ValueError(api_records.header.get('header/resultMsg'))
+    
+    total_count = None
+    if api_records.header.get('body/totalCount'):
+        total_count = int(api_records.header['body/totalCount'])
+    
+    return api_records.items, total_count
 
-            for i in bus_stop_items:
-                stop = {}
-                
-                # 정류소 번호
-                arsid_find = i.find('./nodeno')
-                stop['arsid'] = arsid_find.text if arsid_find is not None else None
-                
-                # 정류장 이름
-                nodenm_elem = i.find('./nodenm')
-                stop['name'] = nodenm_elem.text if nodenm_elem is not None else ''
-                
-                # 좌표 (경도, 위도)
-                gpslong_elem = i.find('./gpslong')
-                gpslati_elem = i.find('./gpslati')
-                if gpslong_elem is not None and gpslati_elem is not None:
-                    stop['pos'] = (float(gpslong_elem.text), float(gpslati_elem.text))
-                else:
-                    stop['pos'] = (0.0, 0.0)
-                
-                # updowncd 저장 (중요!)
-                updown_elem = i.find('./updowncd')
-                stop['updown_cd'] = updown_elem.text if updown_elem is not None else '0'
-                
-                # is_trans는 일단 False로 초기화 (나중에 설정)
-                stop['is_trans'] = False
-                
-                bus_stops.append(stop)
+# [신규] TAGO API 목록의 모든 페이지 조회
+# 첫 페이지의 totalCount로 남은 페이지 수를 구해 나머지 페이지는 동시에 받고, 페이지 순서대로 합침
+# 어느 페이지에서든 오류가 나면 남은 요청을 취소하고 오류를 그대로 발생시킴
+# (일부 페이지만 합친 결과가 완전한 결과로 캐시되지 않도록)
+def get_tago_items(url, params, num_of_rows, timeout, name):
+    def fetch(page_no):
+        try:
+            return get_tago_page(url, params, page_no, num_of_rows, timeout)
+        except TagoApiKeyError:
+            raise
+        except Exception as e:
+            if isinstance(e, requests.exceptions.Timeout):
+                print(f"TAGO API 타임아웃 ({name}, 페이지 {page_no})")
+            else:
+                print(f"TAGO API {name} 오류 (페이지 {page_no}): {str(e)}")
+            raise
+    
+    items, total_count = fetch(1)
+    
+    if len(items) < num_of_rows:
+        return items
+    
+    if total_count is None:
+        # totalCount가 없으면 짧은 페이지가 나올 때까지 차례로 조회
+        page_no = 2
+        while True:
+            page_items, _ = fetch(page_no)
             
-            # 페이지당 행 수보다 적게 반환되면 마지막 페이지
-            if len(bus_stop_items) < num_of_rows:
+            items += page_items
+            if len(page_items) < num_of_rows:
                 break
-                
             page_no += 1
-            
-        except TagoApiKeyError:
+        
+        return items
+    
+    last_page = math.ceil(total_count / num_of_rows)
+    if last_page <= 1:
+        return items
+    
+    with ThreadPoolExecutor(max_workers=min(tago_page_max_workers, last_page - 1)) as executor:
+        futures = [executor.submit(fetch, page_no) for page_no in range(2, last_page + 1)]
+        
+        try:
+            for future in futures:
+                page_items, _ = future.result()
+                items += page_items
+        except Exception:
+            for f in futures:
+                f.cancel()
             raise
-        except requests.exceptions.Timeout:
-            print(f"TAGO API 타임아웃 (페이지 {page_no})")
-            break
-        except Exception as e:
-            print(f"TAGO API 정류장 조회 오류 (페이지 {page_no}): {str(e)}")
-            break
+    
+    return items
+
+# [신규] TAGO API로 노선 경유 정류소 목록을 한 번만 받아 노선형상과 정류장 목록을 함께 만듦
+# (get_tago_bus_route와 get_tago_bus_stops는 같은 엔드포인트를 같은 인자로 조회함)
+@api_cache.cached('tago', 'route_stops')
+def get_tago_bus_route_stops(key, routeid, cityCode):
+    route_positions = []
+    bus_stops = []
+    
+    params = {'serviceKey': key, 'routeId': routeid, 'cityCode': cityCode}
+    bus_stop_items = get_tago_items('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteAcctoThrghSttnList', params, 100, 20, '정류장 조회')
+    
+    for i in bus_stop_items:
+        # 좌표 (경도, 위도) - 노선형상에는 좌표가 있는 정류소만 사용
+        if 'gpslong' in i and 'gpslati' in i:
+            pos = (float(i['gpslong']), float(i['gpslati']))
+            route_positions.append(pos)
+        else:
+            pos = (0.0, 0.0)
+        
+        # 정류소 번호, 정류장 이름, updowncd 저장 (중요!)
+        # is_trans는 일단 False로 초기화 (나중에 설정)
+        stop = BusStop(i.get('nodeno'), i.get('nodenm', ''), pos, False, i.get('updowncd', '0'))
+        
+        bus_stops.append(stop)
     
     # 모든 정류장을 수집한 후 회차지 판단
     for idx in range(len(bus_stops) - 1):
-        current_updown = bus_stops[idx].get('updown_cd', '0')
-        next_updown = bus_stops[idx + 1].get('updown_cd', '0')
+        current_updown = bus_stops[idx].updown_cd
+        next_updown = bus_stops[idx + 1].updown_cd
         
         # 현재가 0이고 다음이 1이면 현재가 회차지
         if current_updown == '0' and next_updown == '1':
-            bus_stops[idx]['is_trans'] = True
+            bus_stops[idx].is_trans = True
             break  # 회차지는 하나만 있으므로 찾으면 종료
     
-    return bus_stops
+    return RouteGeometry(route_positions), bus_stops
+
+# [신규] TAGO API로 버스 정류장 목록 조회
+def get_tago_bus_stops(key, routeid, cityCode):
+    return get_tago_bus_route_stops(key, routeid, cityCode)[1]
 
 
 # ... (기존 get_seoul_bus_type, get_gyeonggi_bus_type, get_busan_bus_type 함수는 변경 없음) ...
+@api_cache.cached('seoul', 'bus_type')
 def get_seoul_bus_type(key, routeid):
     # 서울 버스 노선정보 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params).text
-    route_api_tree = elemtree.fromstring(route_api_res)
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params)
+    route_api_records = parse_records(route_api_res, 'itemList', ['msgHeader/headerCd', 'msgHeader/headerMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
+    api_err = int(route_api_records.header['msgHeader/headerCd'])
     
     if api_err == 7:
         raise SeoulApiKeyError()
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/headerMsg').text)
+        raise ValueError(route_api_records.header.get('msgHeader/headerMsg'))
 
-    route_api_body = route_api_tree.find('./msgBody/itemList')
+    route_api_body = route_api_records.items[0]
     route_info = {}
     
-    route_info['type'] = int(route_api_body.find('./routeType').text)
-    route_info['name'] = route_api_body.find('./busRouteNm').text
-    route_info['start'] = route_api_body.find('./stStationNm').text
-    route_info['end'] = route_api_body.find('./edStationNm').text
+    route_info['type'] = int(route_api_body['routeType'])
+    route_info['name'] = route_api_body['busRouteNm']
+    route_info['start'] = route_api_body['stStationNm']
+    route_info['end'] = route_api_body['edStationNm']
     
     return route_info
 
+@api_cache.cached('gyeonggi', 'bus_type')
 def get_gyeonggi_bus_type(key, routeid):
     # 경기 버스 노선정보 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteInfoItemv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteInfoItemv2', params = params, timeout = 20)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
-        return []
+        raise api_cache.DoNotCache([])
 
-    route_api_tree = elemtree.fromstring(route_api_res.text)
+    route_api_records = parse_records(route_api_res, 'busRouteInfoItem', ['cmmMsgHeader/returnAuthMsg', 'msgHeader/resultCode', 'msgHeader/resultMessage'])
 
-    api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise GyeonggiApiKeyError(api_common_err.text)
+    if 'cmmMsgHeader/returnAuthMsg' in route_api_records.header:
+        raise GyeonggiApiKeyError(route_api_records.header['cmmMsgHeader/returnAuthMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/resultCode').text)
+    api_err = int(route_api_records.header['msgHeader/resultCode'])
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/resultMessage').text)
+        raise ValueError(route_api_records.header.get('msgHeader/resultMessage'))
 
-    route_api_body = route_api_tree.find('./msgBody/busRouteInfoItem')
+    route_api_body = route_api_records.items[0]
     route_info = {}
     
-    route_info['type'] = int(route_api_body.find('./routeTypeCd').text)
-    route_info['name'] = route_api_body.find('./routeName').text
-    route_info['start'] = route_api_body.find('./startStationName').text
-    route_info['end'] = route_api_body.find('./endStationName').text
+    route_info['type'] = int(route_api_body['routeTypeCd'])
+    route_info['name'] = route_api_body['routeName']
+    route_info['start'] = route_api_body['startStationName']
+    route_info['end'] = route_api_body['endStationName']
     
     return route_info
 
+@api_cache.cached('busan', 'bus_type')
 def get_busan_bus_type(key, route_bims_id):
     # 부산 버스 노선정보 조회
     params = {'optBusNum': route_bims_id}
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
-    route_api_tree = elemtree.fromstring(route_api_res)
-
-    bus_stop_items = route_api_tree.findall('./line')
+    route_api_res = http_client.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20)
+    bus_stop_items = parse_records(route_api_res, 'line').items
     
     bus_info_tree = bus_stop_items[0]
     route_info = {}
     
-    route_info['type'] = convert_busan_bus_type(bus_info_tree.attrib['text2'])
-    route_info['name'] = bus_info_tree.attrib['text1']
-    route_info['start'] = bus_info_tree.attrib['text3']
-    route_info['end'] = bus_info_tree.attrib['text4']
+    route_info['type'] = convert_busan_bus_type(bus_info_tree['text2'])
+    route_info['name'] = bus_info_tree['text1']
+    route_info['start'] = bus_info_tree['text3']
+    route_info['end'] = bus_info_tree['text4']
     
     return route_info
 
 # [신규] TAGO API로 버스 노선정보 조회
+@api_cache.cached('tago', 'bus_type')
 def get_tago_bus_type(key, routeid, cityCode):
     params = {'serviceKey': key, 'routeId': routeid, 'cityCode': cityCode, '_type': 'xml'}
     
-    route_api_res = requests.get('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteInfoIem', params = params, timeout = 20)
+    route_api_res = http_client.get('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteInfoIem', params = params, timeout = 20)
     
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
-        return []
+        raise api_cache.DoNotCache([])
 
-    route_api_tree = elemtree.fromstring(route_api_res.text)
+    route_api_records = parse_records(route_api_res, 'item', ['header/resultCode', 'header/resultMsg'])
 
-    api_err_code = route_api_tree.find('./header/resultCode')
+    api_err_code = route_api_records.header.get('header/resultCode')
     if api_err_code is None:
          raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다.")
     
-    if api_err_code.text == '03': # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
-        raise TagoApiKeyError(route_api_tree.find('./header/resultMsg').text)
+    if api_err_code == '03': # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
+        raise TagoApiKeyError(route_api_records.header.get('header/resultMsg'))
 
-    if api_err_code.text != '00': # 00: 정상
-        raise ValueError(route_api_tree.find('./header/resultMsg').text)
+    if api_err_code != '00': # 00: 정상
+        raise ValueError(route_api_records.header.get('header/resultMsg'))
 
-    route_api_body = route_api_tree.find('./body/items/item')
-    if route_api_body is None:
+    if not route_api_records.items:
         return {}  # ← 빈 딕셔너리 반환
-        
+    
+    route_api_body = route_api_records.items[0]
     route_info = {}
     
     # type, name, start, end가 None일 수 있음
-    routetp_elem = route_api_body.find('./routetp')
-    routeno_elem = route_api_body.find('./routeno')
-    startnodenm_elem = route_api_body.find('./startnodenm')
-    endnodenm_elem = route_api_body.find('./endnodenm')
-    
-    route_info['type'] = convert_tago_bus_type(routetp_elem.text) if routetp_elem is not None else 0
-    route_info['name'] = routeno_elem.text if routeno_elem is not None else ''
-    route_info['start'] = startnodenm_elem.text if startnodenm_elem is not None else ''
-    route_info['end'] = endnodenm_elem.text if endnodenm_elem is not None else ''
+    route_info['type'] = convert_tago_bus_type(route_api_body['routetp']) if 'routetp' in route_api_body else 0
+    route_info['name'] = route_api_body.get('routeno', '')
+    route_info['start'] = route_api_body.get('startnodenm', '')
+    route_info['end'] = route_api_body.get('endnodenm', '')
     
     return route_info
 
 
 # ... (기존 get_seoul_bus_route, get_gyeonggi_bus_route, get_busan_bus_route 함수는 변경 없음) ...
+@api_cache.cached('seoul', 'bus_route')
 def get_seoul_bus_route(key, routeid):
     # 서울 버스 노선형상 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params).text
-    route_api_tree = elemtree.fromstring(route_api_res)
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params)
+    route_api_records = parse_records(route_api_res, 'itemList', ['msgHeader/headerCd', 'msgHeader/headerMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
+    api_err = int(route_api_records.header['msgHeader/headerCd'])
 
     if api_err == 7:
         raise SeoulApiKeyError()
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/headerMsg').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    xml_route_positions = route_api_body.findall('./itemList')
+        raise ValueError(route_api_records.header.get('msgHeader/headerMsg'))
 
     route_positions = []
 
-    for i in xml_route_positions:
-        x = float(i.find('./gpsX').text)
-        y = float(i.find('./gpsY').text)
+    for i in route_api_records.items:
+        x = float(i['gpsX'])
+        y = float(i['gpsY'])
         
         route_positions.append((x, y))
     
-    return route_positions
+    return RouteGeometry(route_positions)
 
+@api_cache.cached('gyeonggi', 'bus_route')
 def get_gyeonggi_bus_route(key, routeid):
     # 경기 버스 노선형상 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteLineListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteLineListv2', params = params, timeout = 20)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
-        return []
+        raise api_cache.DoNotCache([])
     
-    route_api_tree = elemtree.fromstring(route_api_res.text)
+    route_api_records = parse_records(route_api_res, 'busRouteLineList', ['cmmMsgHeader/returnAuthMsg', 'msgHeader/resultCode', 'msgHeader/resultMessage'])
     
-    api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise GyeonggiApiKeyError(api_common_err.text)
+    if 'cmmMsgHeader/returnAuthMsg' in route_api_records.header:
+        raise GyeonggiApiKeyError(route_api_records.header['cmmMsgHeader/returnAuthMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/resultCode').text)
+    api_err = int(route_api_records.header['msgHeader/resultCode'])
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/resultMessage').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    xml_route_positions = route_api_body.findall('./busRouteLineList')
+        raise ValueError(route_api_records.header.get('msgHeader/resultMessage'))
 
     route_positions = []
 
-    for i in xml_route_positions:
-        x = float(i.find('./x').text)
-        y = float(i.find('./y').text)
+    for i in route_api_records.items:
+        x = float(i['x'])
+        y = float(i['y'])
         
         route_positions.append((x, y))
     
-    return route_positions
+    return RouteGeometry(route_positions)
 
+@api_cache.cached('busan', 'bus_route')
 def get_busan_bus_route(route_name):
     # 부산 버스 노선형상 조회
     params = {'busLineId': route_name}
     encoded_params = urllib.parse.urlencode(params, encoding='cp949')
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params, timeout = 5).text
-    route_api_tree = elemtree.fromstring(route_api_res)
-    xml_route_positions = route_api_tree.findall('./coord')
+    route_api_res = http_client.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params, timeout = 5)
+    xml_route_positions = parse_records(route_api_res, 'coord').items
     
     if not xml_route_positions:
         return None, None
     
-    route_bims_id = xml_route_positions[0].attrib['value1']
+    route_bims_id = xml_route_positions[0]['value1']
     route_positions = []
 
     for i in xml_route_positions[1:]:
-        x = float(i.attrib['value2'])
-        y = float(i.attrib['value3'])
+        x = float(i['value2'])
+        y = float(i['value3'])
         
         route_positions.append((x, y))
     
-    return route_positions, route_bims_id
+    return RouteGeometry(route_positions), route_bims_id
 
 # [신규] TAGO API로 버스 노선형상 조회
 def get_tago_bus_route(key, routeid, cityCode):
-    route_positions = []
-    page_no = 1
-    num_of_rows = 100  # 한 페이지당 최대 행 수
-    
-    while True:
-        params = {
-            'serviceKey': key, 
-            'routeId': routeid, 
-            'cityCode': cityCode,
-            'pageNo': page_no,
-            'numOfRows': num_of_rows,
-            '_type': 'xml'
-        }
-        
-        try:
-            route_api_res = requests.get(
-                'https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteAcctoThrghSttnList', 
-                params=params, 
-                timeout=20
-            )
-            
-            if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or 
-                    route_api_res.headers.get('Content-Type').startswith('application/xml')):
-                break
-            
-            route_api_tree = elemtree.fromstring(route_api_res.text)
-            
-            api_err_code = route_api_tree.find('./header/resultCode')
-            if api_err_code is None:
-                raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다.")
-            
-            if api_err_code.text == '03':  # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
-                raise TagoApiKeyError(route_api_tree.find('./header/resultMsg').text)
-
-            if api_err_code.text != '00':  # 00: 정상
-                if api_err_code.text == '04':  # NODATA_ERROR
-                    break
-                raise ValueError(route_api_tree.find('./header/resultMsg').text)
-
-            route_api_body = route_api_tree.find('./body/items')
-            if route_api_body is None:
-                break
-                
-            xml_route_positions = route_api_body.findall('./item')
-            
-            if not xml_route_positions:
-                break
-
-            for i in xml_route_positions:
-                x = float(i.find('./gpslong').text)
-                y = float(i.find('./gpslati').text)
-                route_positions.append((x, y))
-            
-            # 페이지당 행 수보다 적게 반환되면 마지막 페이지
-            if len(xml_route_positions) < num_of_rows:
-                break
-                
-            page_no += 1
-            
-        except requests.exceptions.Timeout:
-            print(f"TAGO API 타임아웃 (페이지 {page_no})")
-            break
-        except Exception as e:
-            print(f"TAGO API 노선형상 조회 오류 (페이지 {page_no}): {str(e)}")
-            break
-    
-    return route_positions
+    return get_tago_bus_route_stops(key, routeid, cityCode)[0]
 
 
 # ... (기존 search_seoul_bus_info, search_gyeonggi_bus_info, search_busan_bus_info 함수는 변경 없음) ...
+@api_cache.cached('seoul', 'search')
 def search_seoul_bus_info(key, number):
     params = {'serviceKey': key, 'strSrch': number}
     
-    list_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params).text
-    list_api_tree = elemtree.fromstring(list_api_res)
+    list_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params)
+    list_api_records = parse_records(list_api_res, 'itemList', ['msgHeader/headerCd', 'msgHeader/headerMsg'])
 
-    api_err = int(list_api_tree.find('./msgHeader/headerCd').text)
+    api_err = int(list_api_records.header['msgHeader/headerCd'])
     
     if api_err == 7:
-        raise SeoulApiKeyError(list_api_tree.find('./msgHeader/headerMsg').text)
+        raise SeoulApiKeyError(list_api_records.header.get('msgHeader/headerMsg'))
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(list_api_tree.find('./msgHeader/headerMsg').text)
-
-    list_api_body = list_api_tree.find('./msgBody')
-    xml_bus_list = list_api_body.findall('./itemList')
+        raise ValueError(list_api_records.header.get('msgHeader/headerMsg'))
 
     bus_info_list = []
 
-    for i in xml_bus_list:
-        name = i.find('./busRouteNm').text
-        route_id = i.find('./busRouteId').text
-        start = i.find('./stStationNm').text
-        end = i.find('./edStationNm').text
-        route_type = int(i.find('./routeType').text)
+    for i in list_api_records.items:
+        name = i['busRouteNm']
+        route_id = i['busRouteId']
+        start = i['stStationNm']
+        end = i['edStationNm']
+        route_type = int(i['routeType'])
         
         if route_type == 7 or route_type == 8:
             continue
@@ -668,43 +623,42 @@ def search_seoul_bus_info(key, number):
     
     return bus_info_list
 
+@api_cache.cached('gyeonggi', 'search')
 def search_gyeonggi_bus_info(key, number):
     bus_info_list = []
     
     try:
         params = {'serviceKey': key, 'keyword': number, 'format': 'xml'}
 
-        list_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteListv2', params = params, timeout = 5)
+        list_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteListv2', params = params, timeout = 5)
         if not (list_api_res.headers.get('Content-Type').startswith('text/xml') or list_api_res.headers.get('Content-Type').startswith('application/xml')):
-            return []
+            raise api_cache.DoNotCache([])
         
-        list_api_tree = elemtree.fromstring(list_api_res.text)
+        list_api_records = parse_records(list_api_res, 'busRouteList', ['cmmMsgHeader/returnAuthMsg', 'msgHeader/resultCode', 'msgHeader/resultMessage'])
 
-        api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-        if api_common_err != None:
-            raise GyeonggiApiKeyError(api_common_err.text)
+        if 'cmmMsgHeader/returnAuthMsg' in list_api_records.header:
+            raise GyeonggiApiKeyError(list_api_records.header['cmmMsgHeader/returnAuthMsg'])
         
-        api_err = int(list_api_tree.find('./msgHeader/resultCode').text)
+        api_err = int(list_api_records.header['msgHeader/resultCode'])
         
         if api_err != 0 and api_err != 4:
-            raise ValueError(list_api_tree.find('./msgHeader/resultMessage').text)
+            raise ValueError(list_api_records.header.get('msgHeader/resultMessage'))
         
         if api_err != 4:
-            list_api_body = list_api_tree.find('./msgBody')
-            xml_bus_list = list_api_body.findall('./busRouteList')
-
-            for i in xml_bus_list:
-                name = i.find('./routeName').text
-                route_id = i.find('./routeId').text
-                region = i.find('./regionName').text
-                route_type = int(i.find('./routeTypeCd').text)
+            for i in list_api_records.items:
+                name = i['routeName']
+                route_id = i['routeId']
+                region = i['regionName']
+                route_type = int(i['routeTypeCd'])
                 
                 bus_info_list.append({'name': name, 'id': route_id, 'desc': region, 'type': route_type})
     except requests.exceptions.ConnectTimeout:
         print('Request Timeout')
+        raise api_cache.DoNotCache(bus_info_list)
     
     return bus_info_list
 
+@api_cache.cached('busan', 'search')
 def search_busan_bus_info(key, number):
     bus_info_list = []
     params = {'serviceKey': key, 'lineno': number}
@@ -713,29 +667,26 @@ def search_busan_bus_info(key, number):
     
     for i in range(20):
         try:
-            list_api_res = requests.get('http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params).text
-            if list_api_res.find('http://apis.data.go.kr/503.html') != -1:
+            list_api_res = http_client.get('http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params).content
+            if list_api_res.find(b'http://apis.data.go.kr/503.html') != -1:
                 raise ServerError('503 Server Unavailable')
                 
-            list_api_tree = elemtree.fromstring(list_api_res)
+            list_api_records = parse_records(list_api_res, 'item', ['cmmMsgHeader/returnAuthMsg', 'header/resultCode', 'header/resultMsg'])
             
-            api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-            if api_common_err != None:
-                raise BusanApiKeyError(api_common_err.text)
+            if 'cmmMsgHeader/returnAuthMsg' in list_api_records.header:
+                raise BusanApiKeyError(list_api_records.header['cmmMsgHeader/returnAuthMsg'])
             
-            api_err = int(list_api_tree.find('./header/resultCode').text)
+            api_err = int(list_api_records.header['header/resultCode'])
             
             if api_err != 0:
-                raise ValueError(list_api_tree.find('./header/resultMsg').text)
-            
-            xml_bus_list = list_api_tree.findall('./body/items/item')
+                raise ValueError(list_api_records.header.get('header/resultMsg'))
             
-            for i in xml_bus_list:
-                name = i.find('./buslinenum').text
-                route_id = i.find('./lineid').text
-                start = i.find('./startpoint').text
-                end = i.find('./endpoint').text
-                route_type = convert_busan_bus_type(i.find('./bustype').text)
+            for i in list_api_records.items:
+                name = i['buslinenum']
+                route_id = i['lineid']
+                start = i['startpoint']
+                end = i['endpoint']
+                route_type = convert_busan_bus_type(i['bustype'])
                 
                 bus_info_list.append({'name': name, 'id': route_id, 'desc': start + '~' + end, 'type': route_type})
         except Exception as e:
@@ -751,99 +702,35 @@ def search_busan_bus_info(key, number):
     return bus_info_list
 
 # [신규] TAGO API로 버스 정보 검색 (특정 도시 코드 필요)
+@api_cache.cached('tago', 'search')
 def search_tago_bus_info(key, number, cityCode, cityName):
     bus_info_list = []
-    page_no = 1
-    num_of_rows = 1000  # 한 페이지당 최대 행 수
     
-    while True:
-        try:
-            # TAGO API는 'routeNo' (노선번호)로 검색
-            params = {
-                'serviceKey': key, 
-                'routeNo': number, 
-                'cityCode': cityCode,
-                'pageNo': page_no,
-                'numOfRows': num_of_rows,
-                '_type': 'xml'
-            }
-
-            list_api_res = requests.get(
-                'https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteNoList', 
-                params=params, 
-                timeout=10
-            )
-            
-            if not (list_api_res.headers.get('Content-Type').startswith('text/xml') or 
-                    list_api_res.headers.get('Content-Type').startswith('application/xml')):
-                break
-            
-            list_api_tree = elemtree.fromstring(list_api_res.text)
-
-            api_err_code = list_api_tree.find('./header/resultCode')
-            if api_err_code is None:
-                raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다.")
-            
-            if api_err_code.text == '03':  # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
-                raise TagoApiKeyError(list_api_tree.find('./header/resultMsg').text)
-            
-            # 04: NODATA_ERROR (결과 없음), 00: 정상
-            if api_err_code.text != '00' and api_err_code.text != '04':
-                raise ValueError(list_api_tree.find('./header/resultMsg').text)
-            
-            if api_err_code.text == '04':  # 결과 없음
-                break
-            
-            list_api_body = list_api_tree.find('./body/items')
-            if list_api_body is None:
-                break
-                
-            xml_bus_list = list_api_body.findall('./item')
-            
-            if not xml_bus_list:
-                break
-
-            for i in xml_bus_list:
-                routeno_elem = i.find('./routeno')
-                routeid_elem = i.find('./routeid')
-                startnodenm_elem = i.find('./startnodenm')
-                endnodenm_elem = i.find('./endnodenm')
-                routetp_elem = i.find('./routetp')
-                
-                name = routeno_elem.text if routeno_elem is not None else None
-                route_id = routeid_elem.text if routeid_elem is not None else None
-                start = startnodenm_elem.text if startnodenm_elem is not None else '?'
-                end = endnodenm_elem.text if endnodenm_elem is not None else '?'
-                route_type = convert_tago_bus_type(routetp_elem.text) if routetp_elem is not None else 0
-                
-                # 'id'에 cityCode를 포함시켜, get_tago_... 함수들이 사용할 수 있게 함
-                tago_route_id = f"TAGO|{cityCode}|{route_id}"
-                
-                if not name or not route_id:
-                    continue
-                    
-                bus_info_list.append({
-                    'name': name, 
-                    'id': tago_route_id, 
-                    'desc': f"{start}~{end}", 
-                    'type': route_type
-                })
+    # TAGO API는 'routeNo' (노선번호)로 검색
+    params = {'serviceKey': key, 'routeNo': number, 'cityCode': cityCode}
+    
+    # 오류는 그대로 발생시켜 캐시하지 않음 (통합 검색에서는 도시별 오류를 무시함)
+    xml_bus_list = get_tago_items('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getRouteNoList', params, 1000, 10, f'{cityName} 검색')
+    
+    for i in xml_bus_list:
+        name = i.get('routeno')
+        route_id = i.get('routeid')
+        start = i.get('startnodenm', '?')
+        end = i.get('endnodenm', '?')
+        route_type = convert_tago_bus_type(i['routetp']) if 'routetp' in i else 0
+        
+        # 'id'에 cityCode를 포함시켜, get_tago_... 함수들이 사용할 수 있게 함
+        tago_route_id = f"TAGO|{cityCode}|{route_id}"
+        
+        if not name or not route_id:
+            continue
             
-            # 페이지당 행 수보다 적게 반환되면 마지막 페이지
-            if len(xml_bus_list) < num_of_rows:
-                break
-                
-            page_no += 1
-                
-        except requests.exceptions.ConnectTimeout:
-            print(f'Request Timeout (TAGO {cityName}, 페이지 {page_no})')
-            break
-        except requests.exceptions.Timeout:
-            print(f'Request Timeout (TAGO {cityName}, 페이지 {page_no})')
-            break
-        except Exception as e:
-            print(f'TAGO {cityName} 검색 오류 (페이지 {page_no}): {str(e)}')
-            break
+        bus_info_list.append({
+            'name': name, 
+            'id': tago_route_id, 
+            'desc': f"{start}~{end}", 
+            'type': route_type
+        })
     
     return bus_info_list
 
@@ -854,33 +741,27 @@ def get_tago_city_codes(key):
     params = {'serviceKey': key, '_type': 'xml'}
     
     try:
-        list_api_res = requests.get('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getCtyCodeList', params = params, timeout = 10)
+        list_api_res = http_client.get('https://apis.data.go.kr/1613000/BusRouteInfoInqireService/getCtyCodeList', params = params, timeout = 10)
         
         if not (list_api_res.headers.get('Content-Type').startswith('text/xml') or list_api_res.headers.get('Content-Type').startswith('application/xml')):
             print("TAGO 도시 코드 조회 실패: XML 응답이 아닙니다.")
             return []
 
-        list_api_tree = elemtree.fromstring(list_api_res.text)
+        list_api_records = parse_records(list_api_res, 'item', ['header/resultCode', 'header/resultMsg'])
 
-        api_err_code = list_api_tree.find('./header/resultCode')
+        api_err_code = list_api_records.header.get('header/resultCode')
         if api_err_code is None:
             raise TagoApiKeyError("TAGO API 응답 형식이 올바르지 않습니다. (도시 코드 조회)")
         
-        if api_err_code.text == '03': # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
-            raise TagoApiKeyError(list_api_tree.find('./header/resultMsg').text)
-        
-        if api_err_code.text != '00': # 00: 정상
-            raise ValueError(list_api_tree.find('./header/resultMsg').text)
+        if api_err_code == '03': # SERVICE_KEY_IS_NOT_REGISTERED_ERROR
+            raise TagoApiKeyError(list_api_records.header.get('header/resultMsg'))
         
-        list_api_body = list_api_tree.find('./body/items')
-        if list_api_body is None:
-            return []
-            
-        xml_city_list = list_api_body.findall('./item')
+        if api_err_code != '00': # 00: 정상
+            raise ValueError(list_api_records.header.get('header/resultMsg'))
 
-        for i in xml_city_list:
-            city_code = i.find('./citycode').text
-            city_name = i.find('./cityname').text
+        for i in list_api_records.items:
+            city_code = i['citycode']
+            city_name = i['cityname']
             city_codes_list.append({'name': city_name, 'code': city_code})
             
     except requests.exceptions.RequestException as e:
@@ -889,229 +770,335 @@ def get_tago_city_codes(key):
         
     return city_codes_list
 
-_city_code_cache = {}
+# TAGO 도시 코드 카탈로그 (cache/tago_cities.json에 저장, 검색 대상 도시와 지역명 표시에 사용)
+tago_city_catalog = CityCatalog(os.path.join(cache_dir, 'tago_cities.json'), get_tago_city_codes, seed_path=mapbox.resource_path('resources/tago_cities.json'))
 
 def get_city_name_from_code(city_code):
-    """도시 코드를 도시 이름으로 변환 (캐시 사용)"""
-    # 캐시에 있으면 반환
-    if city_code in _city_code_cache:
-        return _city_code_cache[city_code]
-    
-    # TAGO API 실제 도시 코드 매핑
-    city_code_map = {
-        '12': '세종',
-        '22': '대구',
-        '23': '인천',
-        '24': '광주',
-        '25': '대전',
-        '26': '울산',
-        '39': '제주',
-        # 강원도
-        '32010': '춘천',
-        '32020': '원주',
-        '32050': '태백',
-        '32310': '홍천',
-        '32360': '철원',
-        '32410': '양양',
-        # 충북
-        '33010': '청주',
-        '33020': '충주',
-        '33030': '제천',
-        '33320': '보은',
-        '33330': '옥천',
-        '33340': '영동',
-        '33350': '진천',
-        '33360': '괴산',
-        '33370': '음성',
-        '33380': '단양',
-        # 충남
-        '34010': '천안',
-        '34020': '공주',
-        '34040': '아산',
-        '34050': '서산',
-        '34060': '논산',
-        '34070': '계룡',
-        '34330': '부여',
-        '34390': '당진',
-        # 전북
-        '35010': '전주',
-        '35020': '군산',
-        '35040': '정읍',
-        '35050': '남원',
-        '35060': '김제',
-        '35320': '진안',
-        '35330': '무주',
-        '35340': '장수',
-        '35350': '임실',
-        '35360': '순창',
-        '35370': '고창',
-        '35380': '부안',
-        # 전남
-        '36010': '목포',
-        '36020': '여수',
-        '36030': '순천',
-        '36040': '나주',
-        '36060': '광양',
-        '36320': '곡성',
-        '36330': '구례',
-        '36350': '고흥',
-        '36380': '장흥',
-        '36400': '해남',
-        '36410': '영암',
-        '36420': '무안',
-        '36430': '함평',
-        '36450': '장성',
-        '36460': '완도',
-        '36470': '진도',
-        '36480': '신안',
-        # 경북
-        '37010': '포항',
-        '37020': '경주',
-        '37030': '김천',
-        '37040': '안동',
-        '37050': '구미',
-        '37060': '영주',
-        '37070': '영천',
-        '37080': '상주',
-        '37090': '문경',
-        '37100': '경산',
-        '37320': '의성',
-        '37330': '청송',
-        '37340': '영양',
-        '37350': '영덕',
-        '37360': '청도',
-        '37370': '고령',
-        '37380': '성주',
-        '37390': '칠곡',
-        '37400': '예천',
-        '37410': '봉화',
-        '37420': '울진',
-        '37430': '울릉',
-        # 경남
-        '38010': '창원',
-        '38030': '진주',
-        '38050': '통영',
-        '38060': '사천',
-        '38070': '김해',
-        '38080': '밀양',
-        '38090': '거제',
-        '38100': '양산',
-        '38310': '의령',
-        '38320': '함안',
-        '38330': '창녕',
-        '38340': '고성',
-        '38350': '남해',
-        '38360': '하동',
-        '38370': '산청',
-        '38380': '함양',
-        '38390': '거창',
-        '38400': '합천',
-    }
+    """도시 코드를 도시 이름으로 변환"""
+    return tago_city_catalog.get_name(city_code)
+
+def parse_tago_route_id(route_id):
+    # TAGO 노선 ID 형식: "TAGO|cityCode|routeId"
+    if isinstance(route_id, str) and route_id.startswith('TAGO|'):
+        parts = route_id.split('|')
+        if len(parts) != 3:
+            raise ValueError('TAGO 노선 ID 형식이 올바르지 않습니다.')
+        return parts[1], parts[2]
+    return None
+
+def load_route(key, route_data, cancel_event=None):
+    # 검색 결과(route_data)의 노선형상, 노선정보, 정류장 목록을 한 번에 조회
+    # 서로 의존하지 않는 요청은 동시에 보냄 (부산은 노선형상 조회로 얻은 route_bims_id가 필요함)
+    # cancel_event(threading.Event)가 설정되면 아직 보내지 않은 요청은 취소하고 RouteLoadCancelled를 발생시킴
+    # (이미 보낸 요청은 끝날 때까지 기다리지 않음)
+    tago_route = parse_tago_route_id(route_data['id'])
+    executor = ThreadPoolExecutor(max_workers=3)
+    
+    def result(future):
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RouteLoadCancelled()
+            
+            done, _ = wait([future], timeout=search_cancel_interval if cancel_event is not None else None)
+            if done:
+                return future.result()
+    
+    try:
+        if tago_route is not None:
+            city_code, tago_route_id = tago_route
+            route_stops = executor.submit(get_tago_bus_route_stops, key, tago_route_id, city_code)
+            route_info = executor.submit(get_tago_bus_type, key, tago_route_id, city_code)
+            
+            route_positions, bus_stops = result(route_stops)
+            route_info = result(route_info)
+        elif route_data['type'] <= 10:
+            route_positions = executor.submit(get_seoul_bus_route, key, route_data['id'])
+            route_info = executor.submit(get_seoul_bus_type, key, route_data['id'])
+            bus_stops = executor.submit(get_seoul_bus_stops, key, route_data['id'])
+            
+            route_positions, route_info, bus_stops = result(route_positions), result(route_info), result(bus_stops)
+        elif route_data['type'] <= 60:
+            route_positions = executor.submit(get_gyeonggi_bus_route, key, route_data['id'])
+            route_info = executor.submit(get_gyeonggi_bus_type, key, route_data['id'])
+            bus_stops = executor.submit(get_gyeonggi_bus_stops, key, route_data['id'])
+            
+            route_positions, route_info, bus_stops = result(route_positions), result(route_info), result(bus_stops)
+        else:
+            route_positions, route_bims_id = result(executor.submit(get_busan_bus_route, route_data['name']))
+            route_info = executor.submit(get_busan_bus_type, key, route_bims_id)
+            bus_stops = executor.submit(get_busan_bus_stops, key, route_data['id'], route_bims_id)
+            
+            route_info, bus_stops = result(route_info), result(bus_stops)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
-    city_name = city_code_map.get(city_code, None)
+    return {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}
+
+def get_tago_search_cities(all_tago_cities):
+    # 서울, 경기, 부산 제외 + 경기도 개별 시군 제외
+    excluded_cities = ['서울특별시', '경기도', '부산광역시']
     
-    # 캐시에 저장
-    if city_name:
-        _city_code_cache[city_code] = city_name
+    tago_cities_to_search = []
+    for city in all_tago_cities:
+        # 제외 목록에 있거나, 경기도 개별 시군(31xxx) 제외
+        if city['name'] in excluded_cities:
+            continue
+        if city['code'].startswith('31'):  # 경기도 개별 시군 제외
+            continue
+        if city['code'] == '21':  # 부산 제외
+            continue
+        tago_cities_to_search.append((city['name'], city['code']))
     
-    return city_name
+    return tago_cities_to_search
 
-def search_bus_info(key, number, return_error=False):
-    bus_info_list = []
-    exception = None
+# 로컬 노선 카탈로그 (cache/routes.db)
+# route_catalog_queries의 검색어로 모든 제공자를 검색해 노선 목록을 모아 둠
+route_catalog = RouteCatalog(os.path.join(cache_dir, 'routes.db'))
+route_catalog_queries = [str(i) for i in range(10)]
+route_catalog_harvest_lock = threading.Lock()
+# 백그라운드 수집 전체에 주는 시간 (초)
+route_catalog_harvest_timeout = 10 * 60
+
+def search_route_catalog(number):
+    # 카탈로그가 최신이면 카탈로그에서 검색한 결과를, 아니면 None을 반환
+    if not route_catalog.is_fresh(route_catalog_queries):
+        return None
     
-    # 1. 서울 버스 조회
-    try:
-        bus_info_list += search_seoul_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('서울 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
+    return sort_bus_info_list(route_catalog.search(number), number)
+
+def get_harvest_searches(key, query):
+    # 검색어 하나를 수집하는 제공자별(TAGO는 도시별) 검색 [(수집 키, 함수, 인자), ...]
+    searches = [
+        ('{}|seoul'.format(query), search_seoul_bus_info, (key, query)),
+        ('{}|gyeonggi'.format(query), search_gyeonggi_bus_info, (key, query)),
+        ('{}|busan'.format(query), search_busan_bus_info, (key, query)),
+    ]
     
-    # 2. 경기 버스 조회
-    try:
-        bus_info_list += search_gyeonggi_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('경기 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
+    for city_name, city_code in get_tago_search_cities(tago_city_catalog.get_cities()):
+        searches.append(('{}|tago|{}'.format(query, city_code), search_tago_bus_info, (key, query, city_code, city_name)))
+    
+    return searches
+
+def harvest_route_catalog(key, force=False):
+    # 수집한 지 오래된 검색어만 다시 검색해 카탈로그를 갱신 (이미 수집 중이면 무시)
+    # 통합 검색의 기한(search_timeouts) 대신 전체 수집에 route_catalog_harvest_timeout을 주고,
+    # 제공자별(TAGO는 도시별) 검색이 끝날 때마다 기록해 두어 시간이 초과되거나 오류가 나면 남은 검색만 다음에 다시 수집
+    # 검색어는 모든 세부 검색이 끝나야 수집된 것으로 기록함
+    if not route_catalog_harvest_lock.acquire(blocking=False):
+        return
+    
+    executor = ThreadPoolExecutor(max_workers=http_client.max_workers)
     
-    # 3. 부산 버스 조회
     try:
-        bus_info_list += search_busan_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('부산 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
+        if not tago_city_catalog.has_cities():
+            try:
+                tago_city_catalog.refresh(key)
+            except Exception as e:
+                print(f"도시 코드 목록 갱신 실패: {e}")
         
-    # 4. TAGO API로 나머지 도시 병렬 검색
-    try:
-        all_tago_cities = get_tago_city_codes(key)
+        # TAGO 도시 목록이 없으면 검색어를 끝까지 수집할 수 없음
+        can_complete = tago_city_catalog.has_cities()
         
-        # 서울, 경기, 부산 제외 + 경기도 개별 시군 제외
-        excluded_cities = ['서울특별시', '경기도', '부산광역시']
+        deadline = time.time() + route_catalog_harvest_timeout
+        pending = {}
+        futures = {}
         
-        tago_cities_to_search = []
-        for city in all_tago_cities:
-            # 제외 목록에 있거나, 경기도 개별 시군(31xxx) 제외
-            if city['name'] in excluded_cities:
-                continue
-            if city['code'].startswith('31'):  # 경기도 개별 시군 제외
+        for query in route_catalog_queries:
+            if not force and route_catalog.is_harvested(query):
                 continue
-            if city['code'] == '21':  # 부산 제외
-                continue
-            tago_cities_to_search.append((city['name'], city['code']))
-        
-        # 병렬 처리로 검색 속도 개선
-        def search_single_city(city_info):
-            city_name, city_code = city_info
-            try:
-                return search_tago_bus_info(key, number, city_code, city_name)
-            except ApiKeyError:
-                return None  # API 키 오류는 특별 처리
-            except:
-                return []  # 기타 오류는 빈 리스트
-
-        # ThreadPoolExecutor로 병렬 검색 (최대 15개 동시 실행)
-        with ThreadPoolExecutor(max_workers=15) as executor:
-            # 모든 도시 검색 작업 제출
-            future_to_city = {
-                executor.submit(search_single_city, city_info): city_info 
-                for city_info in tago_cities_to_search
-            }
             
-            # 결과가 나올 때마다 처리
-            for future in as_completed(future_to_city):
-                result = future.result()
+            pending[query] = set()
+            for harvest_key, func, args in get_harvest_searches(key, query):
+                if not force and route_catalog.is_harvested(harvest_key):
+                    continue
                 
-                if result is None:  # API 키 오류
-                    exception = TagoApiKeyError("TAGO API 키 오류")
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    break
-                elif result:  # 결과가 있으면
-                    bus_info_list += result
-                        
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError(f'TAGO 도시 코드 목록 조회 중 오류가 발생했습니다: {str(e)}')
-    
-    # 정렬 함수
-    def search_sort_key(x):
-        # 지역명 추출
-        region = convert_type_to_region(x['type'], x.get('id'))
+                pending[query].add(harvest_key)
+                futures[executor.submit(func, *args)] = (query, harvest_key)
+            
+            if not pending[query] and can_complete:
+                route_catalog.mark_harvested(query)
         
-        # 노선번호 일치도 점수
-        score = search_score(x, number)
+        try:
+            for future in as_completed(futures, timeout=max(0, deadline - time.time())):
+                query, harvest_key = futures[future]
+                
+                try:
+                    bus_info_list = future.result()
+                except Exception:
+                    continue
+                
+                if bus_info_list:
+                    route_catalog.upsert(bus_info_list, convert_type_to_region)
+                route_catalog.mark_harvested(harvest_key)
+                
+                pending[query].discard(harvest_key)
+                if not pending[query] and can_complete:
+                    route_catalog.mark_harvested(query)
+        except TimeoutError:
+            print('노선 카탈로그 수집 시간 초과 (남은 검색은 다음에 수집)')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        route_catalog_harvest_lock.release()
+
+def iter_search_bus_info(key, number, use_catalog=False, cancel_event=None):
+    # 제공자별 검색이 끝날 때마다 (제공자, 노선 목록, 오류)를 내보내는 제너레이터
+    # 오류는 제공자마다 처음 한 번만 내보냄
+    # cancel_event(threading.Event)가 설정되면 대기 중인 요청을 취소하고 바로 끝냄
+    # use_catalog가 True이고 로컬 노선 카탈로그가 최신이면 원격 검색 없이 카탈로그에서 찾음
+    # 카탈로그에 결과가 없으면 원격 검색 후 결과를 카탈로그에 추가
+    if use_catalog:
+        catalog_result = search_route_catalog(number)
+        if catalog_result:
+            yield 'catalog', catalog_result, None
+            return
+    
+    # 서울, 경기, 부산 검색과 TAGO 도시 목록 조회를 한 executor에서 동시에 실행하고,
+    # 도시 목록이 오면 TAGO 도시별 검색을 같은 executor에 추가함
+    # 제공자마다 search_timeouts만큼만 기다림
+    error_providers = set()
+    
+    def make_error(provider, e):
+        if provider in error_providers:
+            return None
+        error_providers.add(provider)
+        
+        name = search_provider_names[provider]
+        if isinstance(e, ApiKeyError):
+            return e
+        elif isinstance(e, TimeoutError):
+            return ServerError(f'{name} 버스 정보 조회 시간이 초과되었습니다.')
+        else:
+            return ValueError(f'{name} 버스 정보를 조회하는 중 오류가 발생했습니다: {str(e)}')
+    
+    start_time = time.time()
+    executor = ThreadPoolExecutor(max_workers=http_client.max_workers)
+    
+    try:
+        futures = {}
+        futures[executor.submit(search_seoul_bus_info, key, number)] = 'seoul'
+        futures[executor.submit(search_gyeonggi_bus_info, key, number)] = 'gyeonggi'
+        futures[executor.submit(search_busan_bus_info, key, number)] = 'busan'
         
-        # (점수, 지역명) 튜플로 정렬
-        # 점수가 낮을수록 우선, 같은 점수면 지역명 가나다순
-        return (score, region if region else 'zzz')
+        # 저장된 도시 목록이 있으면 바로 TAGO 검색을 시작하고, 오래된 목록은 백그라운드에서 갱신
+        # 한 번도 받지 못했으면 목록을 먼저 받아옴
+        city_future = None
+        if tago_city_catalog.has_cities():
+            for city_name, city_code in get_tago_search_cities(tago_city_catalog.get_cities()):
+                futures[executor.submit(search_tago_bus_info, key, number, city_code, city_name)] = 'tago'
+            tago_city_catalog.refresh_async(key)
+        else:
+            city_future = executor.submit(tago_city_catalog.refresh, key)
+            futures[city_future] = 'tago'
+        
+        while futures:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            
+            # 기한이 지난 제공자의 작업은 결과를 기다리지 않음
+            now = time.time()
+            timeout_providers = []
+            for future, provider in list(futures.items()):
+                if now - start_time > search_timeouts[provider]:
+                    future.cancel()
+                    del futures[future]
+                    if provider not in timeout_providers:
+                        timeout_providers.append(provider)
+            
+            for provider in timeout_providers:
+                error = make_error(provider, TimeoutError())
+                if error is not None:
+                    yield provider, [], error
+            
+            if not futures:
+                break
+            
+            deadline = min(start_time + search_timeouts[provider] for provider in futures.values())
+            timeout = max(0, deadline - time.time())
+            if cancel_event is not None:
+                timeout = min(timeout, search_cancel_interval)
+            
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                provider = futures.pop(future)
+                
+                try:
+                    result = future.result()
+                except ApiKeyError as api_err:
+                    if provider == 'tago':
+                        # TAGO 키 오류면 남은 도시 검색은 취소
+                        for f, p in list(futures.items()):
+                            if p == 'tago':
+                                f.cancel()
+                                del futures[f]
+                    
+                    error = make_error(provider, api_err)
+                    if error is not None:
+                        yield provider, [], error
+                    continue
+                except Exception as e:
+                    error = None
+                    if future is city_future:
+                        if provider not in error_providers:
+                            error_providers.add(provider)
+                            error = ValueError(f'TAGO 도시 코드 목록 조회 중 오류가 발생했습니다: {str(e)}')
+                    elif provider != 'tago':
+                        error = make_error(provider, e)
+                    # TAGO 도시별 검색의 기타 오류는 무시
+                    
+                    if error is not None:
+                        yield provider, [], error
+                    continue
+                
+                if future is city_future:
+                    # TAGO API로 나머지 도시 병렬 검색
+                    for city_name, city_code in get_tago_search_cities(result):
+                        futures[executor.submit(search_tago_bus_info, key, number, city_code, city_name)] = 'tago'
+                elif result:
+                    if use_catalog:
+                        route_catalog.upsert(result, convert_type_to_region)
+                    
+                    yield provider, result, None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def search_bus_info(key, number, return_error=False, use_catalog=False):
+    # iter_search_bus_info의 결과를 모두 모아 정렬해 반환
+    # 오류는 제공자별로 모아 SearchError로 반환
+    provider_results = {provider: [] for provider in ['catalog'] + list(search_timeouts)}
+    errors = {}
+    
+    for provider, result, error in iter_search_bus_info(key, number, use_catalog):
+        provider_results[provider] += result
+        if error is not None:
+            errors[provider] = error
+    
+    # 완료 순서와 상관없이 서울, 경기, 부산, TAGO 순으로 합침
+    bus_info_list = []
+    for provider in provider_results:
+        bus_info_list += provider_results[provider]
+    
+    exception = SearchError(errors) if errors else None
     
     if return_error:
-        return sorted(bus_info_list, key=search_sort_key), exception
+        return sort_bus_info_list(bus_info_list, number), exception
     else:
-        return sorted(bus_info_list, key=search_sort_key)
+        return sort_bus_info_list(bus_info_list, number)
+
+# 정렬 함수
+def search_sort_key(x, number):
+    # 지역명 추출
+    region = convert_type_to_region(x['type'], x.get('id'))
+    
+    # 노선번호 일치도 점수
+    score = search_score(x, number)
+    
+    # (점수, 지역명) 튜플로 정렬
+    # 점수가 낮을수록 우선, 같은 점수면 지역명 가나다순
+    return (score, region if region else 'zzz')
+
+def sort_bus_info_list(bus_info_list, number):
+    return sorted(bus_info_list, key=lambda x: search_sort_key(x, number))
 
 # search_score를 별도 함수로 분리
 def search_score(x, number):
@@ -1169,7 +1156,7 @@ def get_naver_map(mapframe, naver_key_id, naver_key):
     
     for p in map_part:
         gps_pos = convert_gps((pos[0] + k * p[0], pos[1] + k * p[1]))
-        map_img.append(requests.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
+        map_img.append(http_client.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
             headers={'X-NCP-APIGW-API-KEY-ID': naver_key_id, 'X-NCP-APIGW-API-KEY': naver_key}).content)
     
     result = ''
@@ -1179,7 +1166,20 @@ def get_naver_map(mapframe, naver_key_id, naver_key):
     
     return result
 
-def get_mapbox_map(mapframe, mapbox_key, mapbox_style, zoom_level=None):
+def get_simplify_tolerance(tile_size, size_factor):
+    # 출력 픽셀 허용 오차를 타일 좌표(4096 단위)로 바꾸고, 캐시 키로 쓸 수 있게 2의 거듭제곱으로 내림
+    # 타일 좌표는 정수이므로 1보다 작으면 단순화하지 않음
+    if mapbox_simplify_pixels <= 0:
+        return 0
+    
+    tolerance = mapbox_simplify_pixels / (tile_size / 4096 * size_factor)
+    if tolerance < 1:
+        return 0
+    
+    return 2 ** int(math.log2(tolerance))
+
+def get_mapbox_map(mapframe, mapbox_key, mapbox_style, zoom_level=None, size_factor=1):
+    # size_factor: 최종 출력에서 노선도 좌표 1만큼의 픽셀 수
     route_size_max = max(mapframe.size())
     
     if zoom_level is None:
@@ -1193,6 +1193,7 @@ def get_mapbox_map(mapframe, mapbox_key, mapbox_style, zoom_level=None):
         level = max(11, min(14, zoom_level))
     
     tile_size = 2 ** (21 - level)
+    simplify_tolerance = get_simplify_tolerance(tile_size, size_factor)
     
     gps_pos = convert_gps((mapframe.left, mapframe.top))
     tile_x1, tile_y1 = mapbox.deg2num(gps_pos[1], gps_pos[0], level)
@@ -1205,47 +1206,124 @@ def get_mapbox_map(mapframe, mapbox_key, mapbox_style, zoom_level=None):
     tile_pos = mapbox.num2deg(tile_x1, tile_y1, level)
     pos_x1, pos_y1 = convert_pos((tile_pos[1], tile_pos[0]))
     
-    style_cache_dir = cache_dir + '/' + mapbox_style.replace("/", "_")
-    if not os.path.exists(style_cache_dir):
-        os.makedirs(style_cache_dir)
+    tiles = [(x, y) for x in range(tile_x1, tile_x2 + 1) for y in range(tile_y1, tile_y2 + 1)]
     
-    for x in range(tile_x1, tile_x2 + 1):
-        for y in range(tile_y1, tile_y2 + 1):
-            cache_filename = style_cache_dir + '/tile{}-{}-z{}.svg'.format(x, y, level)
-            cache_valid = False
-            tile = None
-            rx_svg = re.compile(r'<svg\s.*?>(.*)</svg>', flags = re.DOTALL)
-            
-            pos_x = pos_x1 + (x - tile_x1) * tile_size
-            pos_y = pos_y1 + (y - tile_y1) * tile_size
-
-            if os.path.exists(cache_filename):
-                with open(cache_filename, mode='r', encoding='utf-8') as f:
-                    text = f.read()
-                    svg_match = rx_svg.search(text)
-                    
-                    if svg_match:
-                        cache_valid = True
-                        tile = svg_match[1]
-            
-            if not cache_valid:
-                try:
-                    cache_io = io.StringIO()
-                    mapbox.load_tile(mapbox_style, mapbox_key, x, y, level, draw_full_svg = True, clip_mask = True, fp = cache_io)
-                    
-                    text = cache_io.getvalue()
-                    tile = rx_svg.search(text)[1]
-
-                    with open(cache_filename, mode='w+', encoding='utf-8') as cache_file:
-                        cache_file.write(text)
-                except:
-                    os.remove(cache_filename)
-                    raise
-            
-            result += '<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096)
-            result += tile
-            result += '</g>\n'
+    # 타일을 덮는 영역 (여백 포함)
+    full_clip_rect = mapbox.expand_rect(mapbox_tile_mask_rect, mapbox_clip_margin)
+    
+    def get_clip_rect(x, y):
+        # mapframe을 타일 좌표(y축 위쪽)로 바꾼 클리핑 사각형
+        pos_x = pos_x1 + (x - tile_x1) * tile_size
+        pos_y = pos_y1 + (y - tile_y1) * tile_size
+        scale = 4096 / tile_size
+        
+        frame_rect = ((mapframe.left - pos_x) * scale, 4096 - (mapframe.bottom - pos_y) * scale,
+                      (mapframe.right - pos_x) * scale, 4096 - (mapframe.top - pos_y) * scale)
+        
+        return mapbox.intersect_rect(mapbox.expand_rect(frame_rect, mapbox_clip_margin), full_clip_rect)
+    
+    # 스타일 문서는 레지스트리에서 한 번만 불러와 모든 타일이 공유함
+    # 스타일이 수정되면(modified가 바뀌면) 저장된 SVG 조각은 버림
+    styles = mapbox.load_style(mapbox_style, mapbox_key, cache_dir)
+    revision = styles.get('modified')
+    tileset = mapbox.get_style_tileset(styles)
+    
+    # 저장소에 있는 SVG 조각을 한 번에 읽고, 다시 그려야 하는 타일을 정함
+    # mapframe 가장자리에 걸친 타일은 mapframe마다 잘리는 모양이 다르므로 SVG를 저장하지 않고 매번 그림
+    stored_tiles = tile_store.get_tiles(mapbox_style, revision, level, tile_x1, tile_y1, tile_x2, tile_y2)
+    clip_rects = {tile_pos: get_clip_rect(*tile_pos) for tile_pos in tiles}
+    
+    render_tiles = set()
+    for tile_pos in tiles:
+        svg, svg_simplify = stored_tiles.get(tile_pos, (None, None))
+        if clip_rects[tile_pos] != full_clip_rect or svg is None or svg_simplify != simplify_tolerance:
+            render_tiles.add(tile_pos)
+    
+    # 다시 그릴 타일 중 메모리에 없는 벡터 타일은 저장소(타일셋 단위로 스타일끼리 공유)에서 읽음
+    with decoded_tile_cache_lock:
+        missing_tiles = [tile_pos for tile_pos in render_tiles if (tileset, level) + tile_pos not in decoded_tile_cache]
+    stored_vector_tiles = tile_store.get_vector_tiles(tileset, level, missing_tiles) if missing_tiles else {}
+    
+    new_tiles = []
+    new_vector_tiles = []
+    
+    def load_vector_tile(tile_pos):
+        key = (tileset, level) + tile_pos
+        with decoded_tile_cache_lock:
+            tile = decoded_tile_cache.pop(key, None)
+            if tile is not None:
+                decoded_tile_cache[key] = tile
+                return tile
+        
+        mvt = stored_vector_tiles.get(tile_pos)
+        if mvt is None:
+            mvt = mapbox.fetch_tile(tileset, mapbox_key, tile_pos[0], tile_pos[1], level)
+            new_vector_tiles.append(tile_pos + (mvt,))
+        
+        tile = mapbox.decode_tile(mvt)
+        
+        # 가장 오래 쓰지 않은 타일부터 버림 (dict는 넣은 순서를 유지함)
+        with decoded_tile_cache_lock:
+            decoded_tile_cache[key] = tile
+            while len(decoded_tile_cache) > decoded_tile_cache_size:
+                del decoded_tile_cache[next(iter(decoded_tile_cache))]
+        
+        return tile
+    
+    def load_cached_tile(tile_pos):
+        if tile_pos not in render_tiles:
+            return stored_tiles[tile_pos][0]
+        
+        clip_rect = clip_rects[tile_pos]
+        svg = mapbox.render_tile(load_vector_tile(tile_pos), styles, level, draw_full_svg = False, clip_mask = True, clip_rect = clip_rect, simplify_tolerance = simplify_tolerance)
+        
+        if clip_rect == full_clip_rect:
+            new_tiles.append(tile_pos + (svg, simplify_tolerance))
+        
+        return svg
+    
+    # 타일 다운로드와 렌더링은 병렬로 처리하고, 결과는 격자 순서대로 조립
+    # 새로 받거나 렌더링한 타일은 끝에 한 트랜잭션으로 저장 (중간에 실패해도 완료된 타일은 저장)
+    try:
+        with ThreadPoolExecutor(max_workers=mapbox_max_workers) as executor:
+            for (x, y), tile in zip(tiles, executor.map(load_cached_tile, tiles)):
+                pos_x = pos_x1 + (x - tile_x1) * tile_size
+                pos_y = pos_y1 + (y - tile_y1) * tile_size
+                
+                result += '<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096)
+                result += tile
+                result += '</g>\n'
+    finally:
+        tile_store.put_vector_tiles(tileset, level, new_vector_tiles)
+        tile_store.put_tiles(mapbox_style, revision, level, new_tiles)
             
     result += '</g>\n'
     
-    return result
\ No newline at end of file
+    return result
+
+def get_tile_cache_stats():
+    # 배경 지도 타일 저장소의 타일 수와 크기 (전체, 스타일별, 타일셋별)
+    return tile_store.stats()
+
+def prune_tile_cache(limit=None):
+    # 오래 쓰지 않은 타일부터 지워 limit(기본 tile_cache_max_size) 이하로 줄임
+    return tile_store.prune(limit)
+
+def clear_cache():
+    # 배경 지도 타일과 API 응답 캐시를 지움 (노선 카탈로그, 도시 코드 목록, 스타일 문서는 유지)
+    tile_store.clear()
+    api_cache.clear()
+    
+    with decoded_tile_cache_lock:
+        decoded_tile_cache.clear()
+    
+    # 이전 버전이 스타일별 폴더(cache/<스타일>)에 타일마다 저장한 파일
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return
+    
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and path not in (api_cache.cache_dir, os.path.join(cache_dir, 'styles')):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,115 @@
+import os, re, json, time, threading
+
+# 도시 이름에서 행정구역 접미사를 떼어 짧은 이름을 만듦 (예: 대전광역시 -> 대전, 홍천군 -> 홍천)
+rx_city_suffix = re.compile(r'(특별자치시|특별자치도|특별시|광역시|시|군|도)$')
+
+def short_city_name(name):
+    if not name:
+        return name
+    
+    short_name = rx_city_suffix.sub('', name)
+    
+    # 접미사를 떼고 한 글자만 남으면 원래 이름 사용
+    if len(short_name) < 2:
+        return name
+    return short_name
+
+class CityCatalog():
+    # 도시 코드 목록을 디스크에 저장해 두고 시작할 때 불러오는 카탈로그
+    # fetch(key)는 [{'name': ..., 'code': ...}, ...] 목록을 반환해야 하며, ttl이 지나면 백그라운드에서 새로 받음
+    # seed_path는 path가 없을 때 대신 읽는 같은 형식의 기본 목록 (time이 0이므로 바로 오래된 목록으로 취급됨)
+    def __init__(self, path, fetch, ttl=7 * 24 * 60 * 60, seed_path=None):
+        self.path = path
+        self.fetch = fetch
+        self.ttl = ttl
+        self.seed_path = seed_path
+        
+        self.cities = None
+        self.names = {}
+        self.updated = 0
+        
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.loaded = False
+    
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            
+            for path in (self.path, self.seed_path):
+                if path is None:
+                    continue
+                try:
+                    with open(path, mode='r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    self.set_cities(data['cities'], data.get('time', 0))
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+                break
+    
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump({'time': self.updated, 'cities': self.cities}, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+    
+    def set_cities(self, cities, updated):
+        self.cities = [{'name': city['name'], 'code': city['code']} for city in cities]
+        self.names = {city['code']: short_city_name(city['name']) for city in self.cities}
+        self.updated = updated
+    
+    def has_cities(self):
+        # 목록을 한 번이라도 받았는지 (기본 목록은 이름 표시에만 사용)
+        self.load()
+        return self.cities is not None and self.updated > 0
+    
+    def is_stale(self):
+        self.load()
+        return self.cities is None or time.time() - self.updated > self.ttl
+    
+    def get_cities(self):
+        self.load()
+        return self.cities or []
+    
+    def get_name(self, code):
+        self.load()
+        return self.names.get(code)
+    
+    def refresh(self, key):
+        # 목록을 새로 받아 저장하고 반환 (빈 목록을 받으면 기존 목록을 유지)
+        self.load()
+        cities = self.fetch(key)
+        
+        if cities:
+            with self.lock:
+                self.set_cities(cities, time.time())
+                try:
+                    self.save()
+                except OSError as e:
+                    print(f"도시 코드 목록 저장 실패: {e}")
+        
+        return self.get_cities()
+    
+    def refresh_async(self, key):
+        # 오래된 목록이면 백그라운드에서 새로 받음 (이미 받는 중이면 무시)
+        if not self.is_stale():
+            return
+        
+        with self.lock:
+            if self.refresh_thread is not None and self.refresh_thread.is_alive():
+                return
+            
+            def run():
+                try:
+                    self.refresh(key)
+                except Exception as e:
+                    print(f"도시 코드 목록 갱신 실패: {e}")
+            
+            self.refresh_thread = threading.Thread(target=run, daemon=True)
+            self.refresh_thread.start()
@@ -1,10 +1,11 @@
-import os, sys, json, requests, threading, shutil
+import os, sys, json, requests, threading, bisect
 from PySide6.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, QHBoxLayout, QVBoxLayout, QWidget, QTableWidget, QTableWidgetItem, QAbstractItemView, QPushButton, QGroupBox, QRadioButton, QSpacerItem, QCheckBox, QProgressBar, QMessageBox, QGridLayout, QSlider, QDialog, QComboBox
 from PySide6.QtSvg import QSvgRenderer
 from PySide6.QtSvgWidgets import QSvgWidget
 from PySide6.QtCore import QByteArray, Qt, QBasicTimer, QObject, QEventLoop, Signal, Slot, QThread
 from PySide6.QtGui import QIcon, QTextDocument, QTextOption, QIntValidator
 import bus_api, routemap, mapbox
+from models import RenderStop
 
 version = '1.3'
 
@@ -31,68 +32,121 @@ class RoundedComboBox(QComboBox):
         self.view().window().setWindowFlags(self.view().window().windowFlags() | Qt.WindowType.FramelessWindowHint | Qt.WindowType.NoDropShadowWindowHint)
         self.view().window().setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
 
+class Job():
+    def __init__(self, kind, generation):
+        self.kind = kind
+        self.generation = generation
+        self.cancel_event = threading.Event()
+    
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+class JobManager():
+    # 종류(kind)별로 가장 최근에 시작한 작업만 유효하게 관리
+    # 새 작업을 시작하면 이전 작업은 취소되고, 이전 작업의 결과는 is_current로 걸러냄
+    def __init__(self):
+        self.jobs = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+    
+    def start(self, kind, target, *args):
+        with self.lock:
+            previous = self.jobs.get(kind)
+            if previous is not None:
+                previous.cancel_event.set()
+            
+            self.generation += 1
+            job = Job(kind, self.generation)
+            self.jobs[kind] = job
+        
+        t = threading.Thread(target=target, args=(job,) + args)
+        t.daemon = True
+        t.start()
+        
+        return job
+    
+    def cancel(self, kind):
+        with self.lock:
+            job = self.jobs.pop(kind, None)
+            if job is not None:
+                job.cancel_event.set()
+    
+    def is_current(self, kind, generation):
+        with self.lock:
+            job = self.jobs.get(kind)
+            return job is not None and job.generation == generation
+
 class BusInfoThread(QObject):
-    thread_finished = Signal(str)
+    thread_finished = Signal(object)
     
     def __init__(self, parent):
         super(BusInfoThread, self).__init__(parent)
         self.widget = parent
         
-    def run(self):
-        bus_info_list, error = bus_api.search_bus_info(self.widget.key, self.widget.search_input.text(), return_error = True)
-        error_str = None
-        if error:
-            error_str = str(error)
-        result_json = json.dumps({'result': bus_info_list, 'error': error_str})
+    def run(self, job, query):
+        # 제공자별 검색이 끝날 때마다 결과를 보내고, 마지막에 finished를 보냄
+        # 취소된 작업은 남은 요청을 취소하고 결과를 보내지 않음
+        try:
+            for provider, bus_info_list, error in bus_api.iter_search_bus_info(self.widget.key, query, use_catalog = self.widget.use_route_catalog, cancel_event = job.cancel_event):
+                if job.is_cancelled():
+                    return
+                
+                error_str = None
+                if error:
+                    error_str = str(error)
+                result = {'generation': job.generation, 'result': bus_info_list, 'error': error_str, 'finished': False}
+                
+                self.thread_finished.emit(result)
+        except Exception as e:
+            self.thread_finished.emit({'generation': job.generation, 'result': [], 'error': "[오류] " + str(e), 'finished': False})
         
-        self.thread_finished.emit(result_json)
+        if not job.is_cancelled():
+            self.thread_finished.emit({'generation': job.generation, 'result': [], 'error': None, 'finished': True})
+
+class CatalogSearchThread(QObject):
+    thread_finished = Signal(object)
+    
+    def __init__(self, parent):
+        super(CatalogSearchThread, self).__init__(parent)
+        self.widget = parent
+        
+    def run(self, job, query):
+        # 로컬 노선 카탈로그에서 검색 (카탈로그가 최신이 아니면 result는 None)
+        try:
+            bus_info_list = bus_api.search_route_catalog(query)
+        except Exception:
+            bus_info_list = None
+        
+        if not job.is_cancelled():
+            self.thread_finished.emit({'generation': job.generation, 'query': query, 'result': bus_info_list})
 
 class BusRouteThread(QObject):
-    thread_finished = Signal(str)
+    thread_finished = Signal(object)
     
     def __init__(self, parent):
         super(BusRouteThread, self).__init__(parent)
         self.widget = parent
-        self.route_data = None  # ← 추가
         
-    def run(self):  # ← 들여쓰기 수정 (클래스 레벨)
+    def run(self, job, route_data):
         error = None
         route_positions = None
         route_info = None
         bus_stops = None
         
         try:
-            # [신규] TAGO API 버스인지 확인
-            if isinstance(self.route_data['id'], str) and self.route_data['id'].startswith('TAGO|'):
-                # TAGO API 형식: "TAGO|cityCode|routeId"
-                parts = self.route_data['id'].split('|')
-                if len(parts) == 3:
-                    city_code = parts[1]
-                    tago_route_id = parts[2]
-                    
-                    route_positions = bus_api.get_tago_bus_route(self.widget.key, tago_route_id, city_code)
-                    route_info = bus_api.get_tago_bus_type(self.widget.key, tago_route_id, city_code)
-                    bus_stops = bus_api.get_tago_bus_stops(self.widget.key, tago_route_id, city_code)
-                    
-                    # ← 데이터 검증 추가
-                    if not route_positions or not route_info or not bus_stops:
-                        error = "[오류] TAGO API에서 노선 데이터를 가져오는데 실패했습니다."
-                    elif not isinstance(route_info, dict):
-                        error = "[오류] 노선 정보 형식이 올바르지 않습니다."
-                else:
-                    error = "[오류] TAGO 노선 ID 형식이 올바르지 않습니다."
-            elif self.route_data['type'] <= 10:
-                route_positions = bus_api.get_seoul_bus_route(self.widget.key, self.route_data['id'])
-                route_info = bus_api.get_seoul_bus_type(self.widget.key, self.route_data['id'])
-                bus_stops = bus_api.get_seoul_bus_stops(self.widget.key, self.route_data['id'])
-            elif self.route_data['type'] <= 60:
-                route_positions = bus_api.get_gyeonggi_bus_route(self.widget.key, self.route_data['id'])
-                route_info = bus_api.get_gyeonggi_bus_type(self.widget.key, self.route_data['id'])
-                bus_stops = bus_api.get_gyeonggi_bus_stops(self.widget.key, self.route_data['id'])
-            else:
-                route_positions, route_bims_id = bus_api.get_busan_bus_route(self.route_data['name'])
-                route_info = bus_api.get_busan_bus_type(self.widget.key, route_bims_id)
-                bus_stops = bus_api.get_busan_bus_stops(self.widget.key, self.route_data['id'], route_bims_id)
+            route = bus_api.load_route(self.widget.key, route_data, cancel_event = job.cancel_event)
+            route_positions = route['route_positions']
+            route_info = route['route_info']
+            bus_stops = route['bus_stops']
+            
+            # [신규] TAGO API 데이터 검증
+            if bus_api.parse_tago_route_id(route_data['id']) is not None:
+                if not route_positions or not route_info or not bus_stops:
+                    error = "[오류] TAGO API에서 노선 데이터를 가져오는데 실패했습니다."
+                elif not isinstance(route_info, dict):
+                    error = "[오류] 노선 정보 형식이 올바르지 않습니다."
+        except bus_api.RouteLoadCancelled:
+            return
         except requests.exceptions.ConnectTimeout:
             error = "[오류] Connection Timeout"
         except Exception as e:
@@ -100,8 +154,13 @@ class BusRouteThread(QObject):
             import traceback
             traceback.print_exc()  # ← 디버깅용 (선택사항)
         
-        result_json = json.dumps({'result': {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}, 'error': error})
-        self.thread_finished.emit(result_json)
+        # 다른 노선을 선택해 취소된 작업의 결과는 보내지 않음
+        if job.is_cancelled():
+            return
+        
+        # 정류장, 노선형상 객체를 그대로 넘김 (시그널로 보낼 때 직렬화하지 않음)
+        result = {'generation': job.generation, 'result': {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}, 'error': error}
+        self.thread_finished.emit(result)
 
 
 class OkDialog(QDialog):
@@ -343,12 +402,12 @@ class BusStopEditWindow(QWidget):
         self.bus_stop_table.setRowCount(len(self.parent_window.bus_stops))
         
         for i, stop in enumerate(self.parent_window.bus_stops):
-            item_arsid = QTableWidgetItem(stop.get('arsid'))
-            item_name = QTableWidgetItem(stop['name'])
+            item_arsid = QTableWidgetItem(stop.arsid)
+            item_name = QTableWidgetItem(stop.name)
             item_displayname = QTableWidgetItem('')
             item_section = QTableWidgetItem('1' if i > trans_id else '0')
             
-            pass_stop = bool(routemap.rx_pass_stop.search(stop['name']))
+            pass_stop = bool(routemap.rx_pass_stop.search(stop.name))
             item_pass = QTableWidgetItem('경유' if pass_stop else '정차')
             
             item_arsid.setFlags(item_section.flags() & ~Qt.ItemIsEditable)
@@ -373,14 +432,14 @@ class BusStopEditWindow(QWidget):
             self.bus_stop_table.setCellWidget(i, 5, self.text_direction_combobox_list[i])
         
         for stop in self.parent_window.render_bus_stop_list:
-            self.checkbox_list[stop['ord']].setChecked(True)
-            section = str(stop['section'])
+            self.checkbox_list[stop.ord].setChecked(True)
+            section = str(stop.section)
             
-            self.bus_stop_table.item(stop['ord'], 2).setText(stop['name'])
-            self.bus_stop_table.item(stop['ord'], 3).setText(section)
+            self.bus_stop_table.item(stop.ord, 2).setText(stop.name)
+            self.bus_stop_table.item(stop.ord, 3).setText(section)
             
-            if 'text_dir' in stop:
-                self.text_direction_combobox_list[stop['ord']].setCurrentIndex(stop['text_dir'] + 1)
+            if stop.text_dir is not None:
+                self.text_direction_combobox_list[stop.ord].setCurrentIndex(stop.text_dir + 1)
             
         self.initial_sections = [self.bus_stop_table.item(i, 3).text() for i in range(len(self.parent_window.bus_stops))]
     
@@ -392,6 +451,7 @@ class BusStopEditWindow(QWidget):
     def apply(self):
         bus_stop_list = []
         new_trans_id = 0
+        stop_positions = routemap.convert_pos_array([stop.pos for stop in self.parent_window.bus_stops]).tolist()
         
         for i in range(len(self.parent_window.bus_stops)):
             try:
@@ -407,8 +467,8 @@ class BusStopEditWindow(QWidget):
                 if display_name:
                     name = display_name
                 
-                pos = routemap.convert_pos(self.parent_window.bus_stops[i]['pos'])
-                bus_stop_list.append({'ord': i, 'pos': pos, 'name': name, 'section': section, 'pass': pass_stop, 'text_dir': text_dir})
+                pos = tuple(stop_positions[i])
+                bus_stop_list.append(RenderStop(i, pos, name, section, pass_stop, text_dir))
             
             if section == 1 and new_trans_id == 0:
                 new_trans_id = i - 1
@@ -495,8 +555,8 @@ class RenderThread(QThread):
         for stop in parent.render_bus_stop_list:
             parent.svg_map += parent.bus_routemap.draw_bus_stop_circle(stop, circle_size_factor)
             
-            if 'text_dir' in stop:
-                parent.svg_map += parent.bus_routemap.draw_bus_stop_text(stop, text_size_factor, stop['text_dir'])
+            if stop.text_dir is not None:
+                parent.svg_map += parent.bus_routemap.draw_bus_stop_text(stop, text_size_factor, stop.text_dir)
             else:
                 parent.svg_map += parent.bus_routemap.draw_bus_stop_text(stop, text_size_factor)
         parent.svg_map += parent.bus_routemap.draw_bus_info(info_size_factor) + '\n'
@@ -860,12 +920,18 @@ class MainWindow(QMainWindow):
         
         self.load_key()
         self.bus_info_list = []
+        self.bus_info_keys = []
+        self.search_query = ''
+        self.search_errors = []
         self.preview_points = []
             
+        self.jobs = JobManager()
         self.bus_info_thread = BusInfoThread(self)
         self.bus_route_thread = BusRouteThread(self)
+        self.catalog_search_thread = CatalogSearchThread(self)
         
         self.bus_info_thread.thread_finished.connect(self.bus_info_finished)
+        self.catalog_search_thread.thread_finished.connect(self.catalog_search_finished)
         self.bus_route_thread.thread_finished.connect(self.bus_route_finished)
         
         self.setWindowTitle("버스 노선도 생성기 GUI")
@@ -892,6 +958,7 @@ class MainWindow(QMainWindow):
         
         self.search_input = QLineEdit()
         self.search_input.returnPressed.connect(self.search_input_return)
+        self.search_input.textEdited.connect(self.search_input_edited)
         
         search_label = QLabel("검색: ")
         
@@ -936,6 +1003,16 @@ class MainWindow(QMainWindow):
     
     def showEvent(self, event):
         self.check_key_valid()
+        self.update_route_catalog()
+    
+    def update_route_catalog(self):
+        # 로컬 노선 카탈로그를 사용하면 오래된 부분만 백그라운드에서 다시 수집
+        if not self.use_route_catalog:
+            return
+        
+        t = threading.Thread(target=bus_api.harvest_route_catalog, args=(self.key,))
+        t.daemon = True
+        t.start()
     
     def closeEvent(self, event):
         self.save_key()
@@ -981,62 +1058,113 @@ class MainWindow(QMainWindow):
         if not self.search_input.text():
             return
         
-        self.search_input.setEnabled(False)
+        # 진행 중인 검색과 미리보기는 새 검색으로 대체
+        self.jobs.cancel('catalog')
+        self.jobs.cancel('route')
         self.execute_button.setEnabled(False)
         self.result_table.clearSelection()
         self.svg_widget.load(QByteArray())
         
-        t = threading.Thread(target=self.bus_info_thread.run)
-        t.daemon = True
-        t.start()
+        self.search_query = self.search_input.text()
+        self.search_errors = []
+        self.show_bus_info_list([])
+        self.status_label.setText("검색 중...")
+        
+        self.jobs.start('search', self.bus_info_thread.run, self.search_query)
+    
+    def search_input_edited(self, text):
+        # 로컬 노선 카탈로그가 있으면 입력하는 대로 결과 표시
+        # 카탈로그 검색은 작업 스레드에서 하고, 입력이 바뀌면 이전 검색은 대체됨
+        if not self.use_route_catalog or not text:
+            self.jobs.cancel('catalog')
+            return
+        
+        self.jobs.start('catalog', self.catalog_search_thread.run, text)
+    
+    @Slot(object)
+    def catalog_search_finished(self, result):
+        if not self.jobs.is_current('catalog', result['generation']):
+            return
+        
+        if result['result'] is None:
+            return
+        
+        self.jobs.cancel('search')
+        self.result_table.clearSelection()
+        self.search_query = result['query']
+        self.show_bus_info_list(result['result'])
     
-    @Slot(str)
-    def bus_info_finished(self, result_json):
-        result = json.loads(result_json)
+    @Slot(object)
+    def bus_info_finished(self, result):
+        # 새 검색으로 대체된 이전 검색의 결과는 버림
+        if not self.jobs.is_current('search', result['generation']):
+            return
         
-        self.bus_info_list = result['result']
+        # 도착한 결과를 정렬 순서에 맞는 위치에 끼워 넣음
+        for bus in result['result']:
+            self.insert_bus_info(bus)
         
+        if result['error'] != None:
+            self.search_errors.append(result['error'])
+        
+        if not result['finished']:
+            self.status_label.setText("{}건의 검색 결과가 있습니다. (검색 중...)".format(len(self.bus_info_list)))
+            return
+        
+        self.update_search_status()
+        
+        if self.search_errors:
+            self.status_label.setText(' / '.join(self.search_errors))
+    
+    def update_search_status(self):
         if len(self.bus_info_list) < 1: 
             self.status_label.setText("검색 결과가 없습니다.")
         else:
             self.status_label.setText("{}건의 검색 결과가 있습니다.".format(len(self.bus_info_list)))
+    
+    def show_bus_info_list(self, bus_info_list):
+        # 이미 정렬된 목록으로 표를 새로 채움
+        self.bus_info_list = []
+        self.bus_info_keys = []
+        self.result_table.setRowCount(0)
         
-        if result['error'] != None:
-            self.status_label.setText(result['error'])
-            
-        self.result_table.setRowCount(len(self.bus_info_list))
+        for bus in bus_info_list:
+            self.insert_bus_info(bus)
         
-        for i, bus in enumerate(self.bus_info_list):
-            item_region = QTableWidgetItem(bus_api.convert_type_to_region(bus['type'], bus['id']))
-            item_type = QTableWidgetItem(bus_api.route_type_str[bus['type']])
-            item_name = QTableWidgetItem(bus['name'])
-            item_desc = QTableWidgetItem(bus['desc'])
+        self.update_search_status()
     
-            self.result_table.setItem(i, 0, item_region)
-            self.result_table.setItem(i, 1, item_type)
-            self.result_table.setItem(i, 2, item_name)
-            self.result_table.setItem(i, 3, item_desc)
-            
-        self.search_input.setEnabled(True)
+    def insert_bus_info(self, bus):
+        sort_key = bus_api.search_sort_key(bus, self.search_query)
+        i = bisect.bisect_right(self.bus_info_keys, sort_key)
+        
+        self.bus_info_keys.insert(i, sort_key)
+        self.bus_info_list.insert(i, bus)
+        self.result_table.insertRow(i)
+        
+        item_region = QTableWidgetItem(bus_api.convert_type_to_region(bus['type'], bus['id']))
+        item_type = QTableWidgetItem(bus_api.route_type_str[bus['type']])
+        item_name = QTableWidgetItem(bus['name'])
+        item_desc = QTableWidgetItem(bus['desc'])
+
+        self.result_table.setItem(i, 0, item_region)
+        self.result_table.setItem(i, 1, item_type)
+        self.result_table.setItem(i, 2, item_name)
+        self.result_table.setItem(i, 3, item_desc)
     
     def draw_route_preview(self, item):
-        self.result_table.setEnabled(False)
+        # 다른 노선을 누르면 이전 미리보기 작업은 대체됨
         route_data = self.bus_info_list[item.row()]
-    
+        
+        self.execute_button.setEnabled(False)
         self.preview_line_color, self.preview_line_dark_color = routemap.get_bus_color(route_data)
     
-        # route_data를 thread 객체의 속성으로 저장
-        self.bus_route_thread.route_data = route_data  # ← 추가
+        self.jobs.start('route', self.bus_route_thread.run, route_data)
     
-        t = threading.Thread(target=self.bus_route_thread.run)  # ← args 제거
-        t.daemon = True
-        t.start()
-    
-    @Slot(str)
-    def bus_route_finished(self, result_json):
-        result = json.loads(result_json)
+    @Slot(object)
+    def bus_route_finished(self, result):
+        if not self.jobs.is_current('route', result['generation']):
+            return
         
-        self.result_table.setEnabled(True)
         self.execute_button.setEnabled(True)
         
         if result['error'] != None:
@@ -1048,10 +1176,7 @@ class MainWindow(QMainWindow):
         self.bus_stops = result['result']['bus_stops']
         route_positions = result['result']['route_positions']
         
-        self.preview_points = []
-
-        for pos in route_positions:
-            self.preview_points.append(routemap.convert_pos(pos))
+        self.preview_points = routemap.convert_pos_array(route_positions)
         
         self.render_preview_routemap()
     
@@ -1073,33 +1198,31 @@ class MainWindow(QMainWindow):
             with open('key.json', mode='r', encoding='utf-8') as key_file:
                 key_json = json.load(key_file)
                 self.update_key(key_json['bus_api_key'], key_json['mapbox_key'])
+                self.use_route_catalog = key_json.get('route_catalog', False)
 
                 # v1.1: cache structure changed
                 if 'version' not in key_json:
-                    shutil.rmtree(bus_api.cache_dir)
+                    bus_api.clear_cache()
         except FileNotFoundError:
             with open('key.json', mode='w', encoding='utf-8') as key_file:
-                key_json = {'bus_api_key': '', 'mapbox_key': '', 'version': version}
+                key_json = {'bus_api_key': '', 'mapbox_key': '', 'route_catalog': False, 'version': version}
                 json.dump(key_json, key_file, indent=4)
             
             self.key = ''
             self.mapbox_key = ''
+            self.use_route_catalog = False
     
     def save_key(self):
         with open('key.json', mode='w', encoding='utf-8') as key_file:
-            key_json = {'bus_api_key': self.key, 'mapbox_key': self.mapbox_key, 'version': version}
+            key_json = {'bus_api_key': self.key, 'mapbox_key': self.mapbox_key, 'route_catalog': self.use_route_catalog, 'version': version}
             json.dump(key_json, key_file, indent=4)
 
     def render_preview_routemap(self):
-        if not self.preview_points:
+        if len(self.preview_points) == 0:
             return
         
-        min_x = min(x for x, _ in self.preview_points)
-        max_x = max(x for x, _ in self.preview_points)
-        min_y = min(y for _, y in self.preview_points)
-        max_y = max(y for _, y in self.preview_points)
-        
-        draw_points = []
+        min_x, min_y = self.preview_points.min(axis=0)
+        max_x, max_y = self.preview_points.max(axis=0)
         
         width = 300
         height = 300
@@ -1108,18 +1231,14 @@ class MainWindow(QMainWindow):
             height = width / self.svg_widget.width() * self.svg_widget.height()
             offset_x = 2
             offset_y = height / 2 - ((max_y - min_y) * (width - offset_x * 2) / (max_x - min_x) / 2)
-            for x, y in self.preview_points:
-                adjusted_x = offset_x + (x - min_x) * (width - offset_x * 2) / (max_x - min_x)
-                adjusted_y = offset_y + (y - min_y) * (width - offset_x * 2) / (max_x - min_x)
-                draw_points.append((adjusted_x, adjusted_y))
+            scale = (width - offset_x * 2) / (max_x - min_x)
         else:
             width = height / self.svg_widget.height() * self.svg_widget.width()
             offset_y = 2
             offset_x = width / 2 - ((max_x - min_x) * (height - offset_y * 2) / (max_y - min_y) / 2)
-            for x, y in self.preview_points:
-                adjusted_x = offset_x + (x - min_x) * (height - offset_y * 2) / (max_y - min_y)
-                adjusted_y = offset_y + (y - min_y) * (height - offset_y * 2) / (max_y - min_y)
-                draw_points.append((adjusted_x, adjusted_y))
+            scale = (height - offset_y * 2) / (max_y - min_y)
+        
+        draw_points = (self.preview_points - (min_x, min_y)) * scale + (offset_x, offset_y)
         
         style_path = "display:inline;fill:none;stroke:{};stroke-width:{};stroke-linecap:round;stroke-linejoin:round;stroke-miterlimit:4;stroke-dasharray:none;stroke-opacity:1".format(self.preview_line_color, 2)
         
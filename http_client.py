@@ -0,0 +1,48 @@
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# bus_api의 ThreadPoolExecutor 동시 실행 수와 맞춰 호스트별 연결 풀 크기를 정함
+max_workers = 15
+pool_size = max_workers + 1
+
+default_timeout = 20
+default_headers = {'Accept-Encoding': 'gzip, deflate'}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(url):
+    # 호스트(scheme://netloc)별로 keep-alive 세션을 하나씩 재사용
+    parts = urlsplit(url)
+    host = '{}://{}'.format(parts.scheme, parts.netloc)
+
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(default_headers)
+
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount(host, adapter)
+
+            _sessions[host] = session
+
+    return session
+
+def get(url, params=None, timeout=None, **kwargs):
+    if timeout is None:
+        timeout = default_timeout
+
+    return get_session(url).get(url, params=params, timeout=timeout, **kwargs)
+
+def close():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
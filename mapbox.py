@@ -1,17 +1,24 @@
-import math, requests, json, re, io, colorsys, sys, os
+import math, requests, json, re, io, colorsys, sys, os, time, threading
 import mapbox_vector_tile
+import http_client
 
 tile_url = 'https://api.mapbox.com/v4/{}/{}/{}/{}.mvt'
 style_url = 'https://api.mapbox.com/styles/v1/{}'
-properties = {}
 
 sprite_cache = {}
 
+cache_dir = 'cache'
+style_cache = {}
+style_cache_ttl = 24 * 60 * 60
+style_cache_lock = threading.Lock()
+# 같은 스타일을 동시에 요청하면 한 번만 받도록 스타일마다 두는 잠금
+style_load_locks = {}
+
 class MapBoxError(Exception):
     pass
 
 def check_token_valid(token):
-    response = requests.get(style_url.format(''), params = {'access_token': token})
+    response = http_client.get(style_url.format(''), params = {'access_token': token})
     if response.status_code == 401:
         return False
     else:
@@ -78,168 +85,672 @@ def color_to_rgb(color):
 def color_to_hex(color):
     return rgb_to_hex(color_to_rgb(color))
 
-def interpolate_color(expression, method, input_value, feature):
-    if len(expression) % 2 != 0:
-        raise ValueError()
+color_properties = ('background-color', 'fill-color', 'line-color', 'text-color', 'text-halo-color')
+
+compiled_style_cache = {}
+compiled_style_cache_lock = threading.Lock()
+
+# 스타일 표현식 컴파일러
+# 표현식 트리를 feature -> 값 함수로 미리 변환해 두고, 상수 및 zoom에만 의존하는 부분은 컴파일 시점에 계산함
+# _compile 함수는 (상수 여부, 상수 값 또는 함수) 튜플을 반환함
+
+def _constant(value):
+    return lambda feature: value
+
+def _raiser(error):
+    def evaluate(feature):
+        raise error
+    return evaluate
+
+def _as_function(compiled):
+    is_constant, value = compiled
+    if is_constant:
+        return _constant(value)
+    return value
+
+def _apply(build, compiled_args):
+    fn = build([_as_function(arg) for arg in compiled_args])
     
-    color_list = []
-    value_list = []
+    if all(is_constant for is_constant, _ in compiled_args):
+        try:
+            return True, fn(None)
+        except Exception:
+            # 평가 시점에 오류가 나도록 그대로 둠
+            pass
     
-    for i in range(0, len(expression), 2):
-        color_list.append(expression[i+1])
-        value_list.append(expression[i])
+    return False, fn
+
+def _build_unary(op):
+    def build(args):
+        a = args[0]
+        return lambda feature: op(a(feature))
+    return build
+
+def _build_binary(op):
+    def build(args):
+        a, b = args[0], args[1]
+        return lambda feature: op(a(feature), b(feature))
+    return build
+
+def _build_variadic(op):
+    def build(args):
+        def evaluate(feature):
+            result = args[0](feature)
+            for a in args[1:]:
+                result = op(result, a(feature))
+            return result
+        return evaluate
+    return build
+
+def _build_coalesce(args):
+    def evaluate(feature):
+        for a in args:
+            value = a(feature)
+            if value:
+                return value
+        return args[-1](feature)
+    return evaluate
+
+def _build_at(args):
+    index, array = args[0], args[1]
+    return lambda feature: array(feature)[index(feature)]
+
+_operators = {
+    '!': _build_unary(lambda a: not a),
+    '==': _build_binary(lambda a, b: a == b),
+    '!=': _build_binary(lambda a, b: a != b),
+    '>': _build_binary(lambda a, b: a > b),
+    '<': _build_binary(lambda a, b: a < b),
+    '>=': _build_binary(lambda a, b: a >= b),
+    '<=': _build_binary(lambda a, b: a <= b),
+    '+': _build_variadic(lambda a, b: a + b),
+    '-': _build_binary(lambda a, b: a - b),
+    '*': _build_variadic(lambda a, b: a * b),
+    '/': _build_binary(lambda a, b: a / b),
+    'sqrt': _build_unary(math.sqrt),
+    'to-number': _build_unary(int),
+    'to-string': _build_unary(str),
+    'coalesce': _build_coalesce,
+    'at': _build_at,
+}
+
+def _geometry_type(feature):
+    geometry_type = feature['geometry']['type']
+    if geometry_type == 'MultiPolygon':
+        return 'Polygon'
+    elif geometry_type == 'MultiLineString':
+        return 'LineString'
+    else:
+        return geometry_type
+
+def _compile_logical(values, zoom, is_all):
+    args = []
     
-    rgbs = []
-    result = None
+    for value in values:
+        is_constant, compiled = _compile(value, zoom)
+        if is_constant:
+            # all에서 거짓, any에서 참인 상수가 있으면 결과가 정해짐
+            if bool(compiled) != is_all:
+                return True, not is_all
+            continue
+        args.append(compiled)
     
-    for color in color_list:
-        rgbs.append(color_to_rgb(color))
+    if not args:
+        return True, is_all
     
-    for i in range(len(value_list)):
-        if input_value < value_list[i]:
-            return rgb_to_hex(rgbs[i])
+    if len(args) == 1:
+        a = args[0]
+        return False, lambda feature: bool(a(feature))
     
-    return rgb_to_hex(rgbs[-1])
+    if is_all:
+        def evaluate(feature):
+            for a in args:
+                if not a(feature):
+                    return False
+            return True
+    else:
+        def evaluate(feature):
+            for a in args:
+                if a(feature):
+                    return True
+            return False
     
-    # todo: implement color interpolation
+    return False, evaluate
 
-def interpolate(expression, method, input_value, feature):
-    if len(expression) % 2 != 0:
-        raise ValueError()
+def _compile_match(values, zoom):
+    is_constant, label = _compile(values[0], zoom)
+    default = _compile(values[-1], zoom)
     
-    value = get_value(input_value, feature)
+    branches = []
+    for i in range(1, len(values) - 1, 2):
+        branches.append((values[i], _compile(values[i+1], zoom)))
     
-    if value < expression[0]:
-        return get_value(expression[1], feature)
+    def select(label_value):
+        for labels, output in branches:
+            if isinstance(labels, list):
+                if label_value in labels:
+                    return output
+            elif label_value == labels:
+                return output
+        return default
     
-    if value >= expression[-2]:
-        return get_value(expression[-1], feature)
+    if is_constant:
+        return select(label)
     
-    result_type = get_value(expression[-1], feature)
-    if isinstance(result_type, int) or isinstance(result_type, float):
-        for i in range(2, len(expression), 2):
-            if value < expression[i]:
-                right_value = get_value(expression[i+1], feature)
-                left_value = get_value(expression[i-1], feature)
-                return ((value - expression[i-2]) / (expression[i] - expression[i-2])) * (right_value - left_value) + left_value
-    else:
-        return interpolate_color(expression, method, value, feature)
+    lookup = {}
+    for labels, output in branches:
+        for l in (labels if isinstance(labels, list) else [labels]):
+            lookup.setdefault(l, _as_function(output))
+    default_fn = _as_function(default)
     
+    def evaluate(feature):
+        label_value = label(feature)
+        try:
+            output = lookup.get(label_value, default_fn)
+        except TypeError:
+            output = _as_function(select(label_value))
+        return output(feature)
+    
+    return False, evaluate
+
+def _compile_case(values, zoom):
+    default = _compile(values[-1], zoom)
+    branches = []
+    
+    for i in range(0, len(values) - 1, 2):
+        is_constant, condition = _compile(values[i], zoom)
+        output = _compile(values[i+1], zoom)
+        
+        if is_constant:
+            if condition:
+                default = output
+                break
+            continue
+        
+        branches.append((condition, _as_function(output)))
+    
+    if not branches:
+        return default
+    
+    default_fn = _as_function(default)
+    
+    def evaluate(feature):
+        for condition, output in branches:
+            if condition(feature):
+                return output(feature)
+        return default_fn(feature)
+    
+    return False, evaluate
+
+def _compile_step(values, zoom):
+    is_constant, label = _compile(values[0], zoom)
+    outputs = [_compile(values[i], zoom) for i in range(1, len(values), 2)]
+    stops = [values[i] for i in range(2, len(values) - 1, 2)]
+    
+    def select(label_value):
+        for i, stop in enumerate(stops):
+            if stop > label_value:
+                return i
+        return len(outputs) - 1
+    
+    if is_constant:
+        return outputs[select(label)]
+    
+    output_fns = [_as_function(output) for output in outputs]
+    
+    return False, lambda feature: output_fns[select(label(feature))](feature)
+
+def _compile_interpolate(values, zoom):
     # todo: implement exponentional interpolation
+    if (len(values) - 2) % 2 != 0:
+        return False, _raiser(ValueError())
+    
+    is_constant, input_value = _compile(values[1], zoom)
+    stops = values[2::2]
+    outputs = [_compile(v, zoom) for v in values[3::2]]
+    output_fns = [_as_function(output) for output in outputs]
+    
+    def interpolate(value, feature):
+        result_type = output_fns[-1](feature)
+        
+        if isinstance(result_type, int) or isinstance(result_type, float):
+            for i in range(1, len(stops)):
+                if value < stops[i]:
+                    right_value = output_fns[i](feature)
+                    left_value = output_fns[i-1](feature)
+                    return ((value - stops[i-1]) / (stops[i] - stops[i-1])) * (right_value - left_value) + left_value
+        else:
+            # todo: implement color interpolation
+            for i in range(len(stops)):
+                if value < stops[i]:
+                    return rgb_to_hex(color_to_rgb(output_fns[i](feature)))
+            return rgb_to_hex(color_to_rgb(result_type))
+    
+    def select(value, feature):
+        if value < stops[0]:
+            return output_fns[0](feature)
+        if value >= stops[-1]:
+            return output_fns[-1](feature)
+        return interpolate(value, feature)
+    
+    if is_constant:
+        if input_value < stops[0]:
+            return outputs[0]
+        if input_value >= stops[-1]:
+            return outputs[-1]
+        return _apply(lambda args: lambda feature: interpolate(input_value, feature), outputs)
+    
+    return False, lambda feature: select(input_value(feature), feature)
 
-def get_value(expression, feature):
-    if isinstance(expression, list):
-        op = expression[0]
-        values = expression[1:]
-        
-        if not isinstance(op, str):
-            return expression
-        
-        if op == '!':
-            return not get_value(values[0], feature)
-        elif op == '==':
-            return get_value(values[0], feature) == get_value(values[1], feature)
-        elif op == '!=':
-            return get_value(values[0], feature) != get_value(values[1], feature)
-        elif op == '>':
-            return get_value(values[0], feature) > get_value(values[1], feature)
-        elif op == '<':
-            return get_value(values[0], feature) < get_value(values[1], feature)
-        elif op == '>=':
-            return get_value(values[0], feature) >= get_value(values[1], feature)
-        elif op == '<=':
-            return get_value(values[0], feature) <= get_value(values[1], feature)
-        elif op == '+':
-            return get_value(values[0], feature) + get_value(values[1], feature)
-        elif op == '-':
-            return get_value(values[0], feature) - get_value(values[1], feature)
-        elif op == '*':
-            return get_value(values[0], feature) * get_value(values[1], feature)
-        elif op == '/':
-            return get_value(values[0], feature) / get_value(values[1], feature)
-        elif op == 'sqrt':
-            return math.sqrt(get_value(values[0], feature))
-        elif op == 'zoom':
-            return properties['zoom']
-        elif op == 'all':
-            for value in values:
-                if not get_value(value, feature):
-                    return False
-            return True
-        elif op == 'any':
-            for value in values:
-                if get_value(value):
-                    return True
-            return False
-        elif op == 'at':
-            if len(values) != 2:
-                raise ValueError()
-            if not isinstance(values[2], list):
-                raise TypeError()
-            return get_value(values[2][get_value(values[1], feature)], feature)
-        elif op == 'get':
-            if values[0] in feature['properties']:
-                return feature['properties'][values[0]]
-            else:
-                return 0
-        elif op == 'has':
-            if len(values) == 1:
-                return bool(values[0] in feature['properties'])
-            else:
-                raise ValueError()
-        elif op == 'literal':
-            return values[0]
-        elif op == 'to-number':
-            return int(get_value(values[0], feature))
-        elif op == 'to-string':
-            return str(get_value(values[0], feature))
-        elif op == 'match':
-            label = get_value(values[0], feature)
-            for i in range(1, len(values) - 1):
-                if isinstance(values[i], list):
-                    if label in values[i]:
-                        return get_value(values[i+1], feature)
+def _compile(expression, zoom):
+    if not isinstance(expression, list) or not expression or not isinstance(expression[0], str):
+        return True, expression
+    
+    op = expression[0]
+    values = expression[1:]
+    
+    if op == 'literal':
+        return True, values[0]
+    elif op == 'zoom':
+        return True, zoom
+    elif op == 'get':
+        name = values[0]
+        return False, lambda feature: feature['properties'].get(name, 0)
+    elif op == 'has':
+        if len(values) != 1:
+            return False, _raiser(ValueError())
+        name = values[0]
+        return False, lambda feature: name in feature['properties']
+    elif op == 'geometry-type':
+        return False, _geometry_type
+    elif op == 'all':
+        return _compile_logical(values, zoom, True)
+    elif op == 'any':
+        return _compile_logical(values, zoom, False)
+    elif op == 'match':
+        return _compile_match(values, zoom)
+    elif op == 'case':
+        return _compile_case(values, zoom)
+    elif op == 'step':
+        return _compile_step(values, zoom)
+    elif op == 'interpolate':
+        return _compile_interpolate(values, zoom)
+    elif op in _operators:
+        return _apply(_operators[op], [_compile(value, zoom) for value in values])
+    else:
+        return False, _raiser(ValueError('Unknown Expression: "{}"'.format(op)))
+
+def _compile_color(expression, zoom):
+    is_constant, value = _compile(expression, zoom)
+    
+    if is_constant:
+        try:
+            return True, color_to_hex(value)
+        except Exception as e:
+            return False, _raiser(e)
+    
+    return False, lambda feature: color_to_hex(value(feature))
+
+def compile_expression(expression, zoom, color = False):
+    if color:
+        return _as_function(_compile_color(expression, zoom))
+    else:
+        return _as_function(_compile(expression, zoom))
+
+def compile_layer(layer, zoom):
+    compiled = {'id': layer['id'], 'type': layer['type'], 'source-layer': layer.get('source-layer'), 'filter': None, 'paint': {}, 'layout': {}}
+    
+    if 'filter' in layer:
+        compiled['filter'] = compile_expression(layer['filter'], zoom)
+    
+    for group in ('paint', 'layout'):
+        for name, value in layer.get(group, {}).items():
+            if name == 'text-font':
+                compiled[group][name] = value
+            elif name == 'line-dasharray':
+                if isinstance(value, list):
+                    compiled[group][name] = _constant(''.join('{} '.format(dash) for dash in value))
                 else:
-                    if label == values[i]:
-                        return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'case':
-            for i in range(0, len(values) - 1, 2):
-                if get_value(values[i], feature):
-                    return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'coalesce':
-            for i in range(0, len(values)):
-                value = get_value(values[i], feature)
-                if value:
-                    return value
-            return get_value(values[-1], feature)
-        elif op == 'step':
-            label = get_value(values[0], feature)
-            for i in range(2, len(values) - 1, 2):
-                if values[i] > label:
-                    return get_value(values[i-1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'interpolate':
-            return interpolate(values[2:], values[0], values[1], feature)
-        elif op == 'geometry-type':
-            geometry_type = feature['geometry']['type']
-            if geometry_type == 'MultiPolygon':
-                return 'Polygon'
-            elif geometry_type == 'MultiLineString':
-                return 'LineString'
+                    compiled[group][name] = _raiser(TypeError())
+            else:
+                compiled[group][name] = compile_expression(value, zoom, name in color_properties)
+    
+    return compiled
+
+def compile_style(styles, zoom):
+    # 스타일과 줌 레벨마다 레이어를 한 번만 컴파일함
+    key = (id(styles), zoom)
+    
+    with compiled_style_cache_lock:
+        entry = compiled_style_cache.get(key)
+    
+    if entry is not None and entry[0] is styles:
+        return entry[1]
+    
+    layers = []
+    for layer in styles['layers']:
+        if 'minzoom' in layer:
+            if layer['minzoom'] > zoom:
+                continue
+        
+        layers.append(compile_layer(layer, zoom))
+    
+    with compiled_style_cache_lock:
+        if len(compiled_style_cache) > 32:
+            compiled_style_cache.clear()
+        compiled_style_cache[key] = (styles, layers)
+    
+    return layers
+
+def get_value(expression, feature, zoom = None):
+    return compile_expression(expression, zoom)(feature)
+    
+def get_color(color_style, feature = None, zoom = None):
+    return compile_expression(color_style, zoom, color = True)(feature)
+
+# 타일 좌표(y축 위쪽, 0~4096) 기준 클리핑
+# clip_rect는 (left, bottom, right, top)
+# 기호는 글자가 클리핑 사각형 안으로 걸칠 수 있으므로 앵커 점을 더 넓은 사각형으로 판단
+symbol_clip_margin = 1024
+
+def expand_rect(rect, margin):
+    return (rect[0] - margin, rect[1] - margin, rect[2] + margin, rect[3] + margin)
+
+def intersect_rect(a, b):
+    return (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+
+def point_in_rect(point, rect):
+    return rect[0] <= point[0] <= rect[2] and rect[1] <= point[1] <= rect[3]
+
+def points_bounds(points, bounds = None):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    
+    if bounds is None:
+        return (min(xs), min(ys), max(xs), max(ys))
+    
+    return (min(bounds[0], min(xs)), min(bounds[1], min(ys)), max(bounds[2], max(xs)), max(bounds[3], max(ys)))
+
+def _clip_ring_edge(points, axis, value, keep_greater):
+    # Sutherland–Hodgman: 한 변(axis = value)의 안쪽만 남김
+    result = []
+    prev = points[-1]
+    prev_in = prev[axis] >= value if keep_greater else prev[axis] <= value
+    
+    for p in points:
+        p_in = p[axis] >= value if keep_greater else p[axis] <= value
+        
+        if p_in != prev_in:
+            t = (value - prev[axis]) / (p[axis] - prev[axis])
+            if axis == 0:
+                result.append((value, round(prev[1] + t * (p[1] - prev[1]), 1)))
             else:
-                return geometry_type
+                result.append((round(prev[0] + t * (p[0] - prev[0]), 1), value))
+        
+        if p_in:
+            result.append(p)
+        
+        prev = p
+        prev_in = p_in
+    
+    return result
+
+def clip_ring(ring, rect):
+    # 다각형 고리를 사각형으로 자름 (점이 3개 미만이 되면 None)
+    points = ring
+    for axis, value, keep_greater in ((0, rect[0], True), (0, rect[2], False), (1, rect[1], True), (1, rect[3], False)):
+        points = _clip_ring_edge(points, axis, value, keep_greater)
+        if not points:
+            return None
+    
+    if len(points) < 3:
+        return None
+    
+    return points
+
+def _clip_segment(a, b, rect):
+    # Liang–Barsky: 선분 a-b 중 사각형 안쪽 부분 (없으면 None)
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    t0, t1 = 0.0, 1.0
+    
+    for p, q in ((-dx, a[0] - rect[0]), (dx, rect[2] - a[0]), (-dy, a[1] - rect[1]), (dy, rect[3] - a[1])):
+        if p == 0:
+            if q < 0:
+                return None
         else:
-            raise ValueError('Unknown Expression: "{}"'.format(op))
-    else:
-        return expression
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return None
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return None
+                t1 = min(t1, t)
+    
+    start = a if t0 == 0 else (round(a[0] + t0 * dx, 1), round(a[1] + t0 * dy, 1))
+    end = b if t1 == 1 else (round(a[0] + t1 * dx, 1), round(a[1] + t1 * dy, 1))
+    
+    return start, end
+
+def clip_line(points, rect):
+    # 선을 사각형으로 자르고, 사각형 안에 남는 구간 목록을 반환
+    parts = []
+    current = None
+    
+    for a, b in zip(points, points[1:]):
+        segment = _clip_segment(a, b, rect)
+        if segment is None:
+            current = None
+            continue
+        
+        start, end = segment
+        if current is None or start is not a:
+            current = [start]
+            parts.append(current)
+        current.append(end)
+        
+        if end is not b:
+            current = None
+    
+    return parts
+
+def clip_geometry(geometry, rect):
+    # 사각형 안쪽만 남긴 geometry를 반환 (모두 밖이면 None, 모두 안이면 그대로 반환)
+    geometry_type = geometry['type']
+    coords = geometry['coordinates']
     
-def get_color(color_style, feature = None):
-    if isinstance(color_style, str):
-        return color_to_hex(color_style)
+    if geometry_type == 'Point':
+        return geometry if point_in_rect(coords, expand_rect(rect, symbol_clip_margin)) else None
+    elif geometry_type == 'MultiPoint':
+        symbol_rect = expand_rect(rect, symbol_clip_margin)
+        points = [p for p in coords if point_in_rect(p, symbol_rect)]
+        return {'type': geometry_type, 'coordinates': points} if points else None
+    
+    if geometry_type == 'Polygon':
+        polygons = [coords]
+    elif geometry_type == 'MultiPolygon':
+        polygons = coords
+    elif geometry_type == 'LineString':
+        lines = [coords]
+    elif geometry_type == 'MultiLineString':
+        lines = coords
     else:
-        return color_to_hex(get_value(color_style, feature))
+        return geometry
+    
+    rings = [ring for polygon in polygons for ring in polygon] if geometry_type in ('Polygon', 'MultiPolygon') else lines
+    
+    bounds = None
+    for ring in rings:
+        if ring:
+            bounds = points_bounds(ring, bounds)
+    
+    if bounds is None or bounds[0] > rect[2] or bounds[2] < rect[0] or bounds[1] > rect[3] or bounds[3] < rect[1]:
+        return None
+    
+    if bounds[0] >= rect[0] and bounds[2] <= rect[2] and bounds[1] >= rect[1] and bounds[3] <= rect[3]:
+        return geometry
+    
+    if geometry_type in ('Polygon', 'MultiPolygon'):
+        clipped_polygons = []
+        for polygon in polygons:
+            # 바깥 고리가 사라지면 구멍도 버림
+            exterior = clip_ring(polygon[0], rect) if polygon else None
+            if exterior is None:
+                continue
+            
+            clipped = [exterior]
+            for hole in polygon[1:]:
+                hole = clip_ring(hole, rect)
+                if hole is not None:
+                    clipped.append(hole)
+            clipped_polygons.append(clipped)
+        
+        if not clipped_polygons:
+            return None
+        elif geometry_type == 'Polygon':
+            return {'type': 'Polygon', 'coordinates': clipped_polygons[0]}
+        
+        return {'type': 'MultiPolygon', 'coordinates': clipped_polygons}
+    
+    parts = []
+    for line in lines:
+        parts += clip_line(line, rect)
+    
+    if not parts:
+        return None
+    elif len(parts) == 1:
+        return {'type': 'LineString', 'coordinates': parts[0]}
+    
+    return {'type': 'MultiLineString', 'coordinates': parts}
+
+def simplify_line(points, tolerance):
+    # Douglas–Peucker: 양 끝점을 잇는 선분에서 tolerance 이내인 점을 제거
+    n = len(points)
+    if n < 3:
+        return points
+    
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, n - 1)]
+    
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first][0], points[first][1]
+        dx = points[last][0] - ax
+        dy = points[last][1] - ay
+        length_sq = dx * dx + dy * dy
+        
+        max_dist = -1
+        index = -1
+        for i in range(first + 1, last):
+            px = points[i][0] - ax
+            py = points[i][1] - ay
+            
+            if length_sq > 0:
+                t = min(1, max(0, (px * dx + py * dy) / length_sq))
+                px -= t * dx
+                py -= t * dy
+            
+            dist = px * px + py * py
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        
+        if max_dist > tolerance_sq:
+            keep[index] = True
+            if index - first > 1:
+                stack.append((first, index))
+            if last - index > 1:
+                stack.append((index, last))
+    
+    return [p for p, k in zip(points, keep) if k]
+
+def is_tiny(points, tolerance):
+    # 가로, 세로 모두 tolerance보다 작아 출력에서 점 하나 크기도 안 되는 도형
+    bounds = points_bounds(points)
+    return bounds[2] - bounds[0] < tolerance and bounds[3] - bounds[1] < tolerance
+
+def simplify_ring(ring, tolerance):
+    if not ring or is_tiny(ring, tolerance):
+        return None
+    
+    ring = simplify_line(ring, tolerance)
+    
+    # 닫힌 고리는 첫 점이 마지막에 한 번 더 들어 있음
+    closed = ring[0][0] == ring[-1][0] and ring[0][1] == ring[-1][1]
+    if len(ring) < (4 if closed else 3):
+        return None
+    
+    return ring
+
+def simplify_geometry(geometry, tolerance):
+    # 출력에서 보이지 않는 꼭짓점과 작은 도형을 제거 (모두 사라지면 None)
+    geometry_type = geometry['type']
+    coords = geometry['coordinates']
+    
+    if geometry_type in ('Polygon', 'MultiPolygon'):
+        polygons = [coords] if geometry_type == 'Polygon' else coords
+        simplified_polygons = []
+        
+        for polygon in polygons:
+            exterior = simplify_ring(polygon[0], tolerance) if polygon else None
+            if exterior is None:
+                continue
+            
+            simplified = [exterior]
+            for hole in polygon[1:]:
+                hole = simplify_ring(hole, tolerance)
+                if hole is not None:
+                    simplified.append(hole)
+            simplified_polygons.append(simplified)
+        
+        if not simplified_polygons:
+            return None
+        elif geometry_type == 'Polygon':
+            return {'type': 'Polygon', 'coordinates': simplified_polygons[0]}
+        
+        return {'type': 'MultiPolygon', 'coordinates': simplified_polygons}
+    elif geometry_type in ('LineString', 'MultiLineString'):
+        lines = [coords] if geometry_type == 'LineString' else coords
+        lines = [simplify_line(line, tolerance) for line in lines if line and not is_tiny(line, tolerance)]
+        
+        if not lines:
+            return None
+        elif geometry_type == 'LineString':
+            return {'type': 'LineString', 'coordinates': lines[0]}
+        
+        return {'type': 'MultiLineString', 'coordinates': lines}
+    
+    return geometry
+
+def prepare_geometry(geometry, clip_rect, simplify_tolerance):
+    if clip_rect is not None:
+        geometry = clip_geometry(geometry, clip_rect)
+        if geometry is None:
+            return None
+    
+    if simplify_tolerance:
+        geometry = simplify_geometry(geometry, simplify_tolerance)
+    
+    return geometry
+
+def prepare_feature(feature, clip_rect, simplify_tolerance, prepared_geometries):
+    # 피처를 클리핑, 단순화한 결과 (그릴 것이 없으면 None)
+    # 여러 레이어가 같은 피처를 그릴 수 있으므로 결과를 피처별로 한 번만 계산
+    key = id(feature)
+    if key not in prepared_geometries:
+        prepared_geometries[key] = prepare_geometry(feature['geometry'], clip_rect, simplify_tolerance)
+    
+    geometry = prepared_geometries[key]
+    if geometry is None:
+        return None
+    elif geometry is feature['geometry']:
+        return feature
+    
+    return dict(feature, geometry = geometry)
 
 def draw_geometry(f, feature, style):
     style_str = css_style(style)
@@ -287,14 +798,14 @@ def draw_symbol(f, feature, layout, paint):
         icon_image = None
         
         if 'icon-image' in layout:
-            icon_image = layout['icon-image']
+            icon_image = layout['icon-image'](feature)
         
         if icon_image:
-            sprite = load_sprite(get_value(icon_image, feature))
+            sprite = load_sprite(icon_image)
             size = 1
             
             if 'icon-size' in layout:
-                size = get_value(layout['icon-size'], feature)
+                size = layout['icon-size'](feature)
             
             size *= 8
             x = coord[0] - (sprite['size'][0] / 2) * size
@@ -305,27 +816,27 @@ def draw_symbol(f, feature, layout, paint):
             f.write('</g>\n')
         
         if 'text-field' in layout:
-            text = get_value(layout['text-field'], feature)
+            text = layout['text-field'](feature)
             text_style = {'fill': '#111111', 'stroke': 'none', 'text-anchor': 'middle', 'font-size': 15, 'text-align': 'center'}
             
             if 'text-font' in layout:
                 text_style['font-family'] = layout['text-font'][0]
             
             if 'text-size' in layout:
-                text_style['font-size'] = get_value(layout['text-size'], feature) * 8
+                text_style['font-size'] = layout['text-size'](feature) * 8
                 text_style['stroke-width'] = text_style['font-size'] / 4
             
             if 'text-color' in paint:
-                text_style['fill'] = get_color(paint['text-color'], feature)
+                text_style['fill'] = paint['text-color'](feature)
                 
             if 'text-halo-color' in paint:
-                text_style['stroke'] = get_color(paint['text-halo-color'], feature)
+                text_style['stroke'] = paint['text-halo-color'](feature)
             
             x = coord[0]
             y = coord[1]
             
             if 'text-offset' in layout:
-                text_offset = get_value(layout['text-offset'], feature)
+                text_offset = layout['text-offset'](feature)
                 
                 x += text_offset[0] * text_style['font-size']
                 y -= text_offset[1] * text_style['font-size']
@@ -355,29 +866,121 @@ def load_sprite(sprite_id):
     else:
         raise ValueError()
 
-def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None):
-    properties['x'] = x
-    properties['y'] = y
-    properties['zoom'] = zoom
-    
-    # Load styles
-    style_response = requests.get(style_url.format(style_id), params = {'access_token': token})
-    styles = style_response.json()
-    
-    if style_response.status_code != 200:
-        if 'message' in styles:
-            raise MapBoxError(styles['message'])
-    
+def get_style_tileset(styles):
     # Get tileset sources
-    if re.match(r'mapbox://', styles['sources']['composite']['url']) and styles['sources']['composite']['type'] == 'vector':
-        sources = styles['sources']['composite']['url'][9:]
+    try:
+        composite = styles['sources']['composite']
+    except (KeyError, TypeError):
+        raise ValueError('Style has no composite source')
+    
+    if re.match(r'mapbox://', composite['url']) and composite['type'] == 'vector':
+        return composite['url'][9:]
     else:
         raise ValueError()
+
+def validate_style(styles):
+    if not isinstance(styles, dict) or not isinstance(styles.get('layers'), list):
+        raise ValueError('Invalid style document')
     
+    get_style_tileset(styles)
+
+def style_cache_path(style_id, style_cache_dir = None):
+    if style_cache_dir is None:
+        style_cache_dir = cache_dir
+    
+    return os.path.join(style_cache_dir, 'styles', style_id.replace('/', '_') + '.json')
+
+def get_cached_style(style_id, ttl):
+    with style_cache_lock:
+        entry = style_cache.get(style_id)
+    
+    if entry is not None and time.time() - entry[1] < ttl:
+        return entry[0]
+    
+    return None
+
+def load_style(style_id, token, style_cache_dir = None, ttl = None):
+    # 스타일 문서는 스타일마다 한 번만 받아서 메모리와 디스크(cache/styles)에 보관
+    # style_cache_lock은 메모리 캐시를 읽고 쓸 때만 잡으므로, 스타일을 받는 동안에도 다른 스레드는 기다리지 않음
+    if ttl is None:
+        ttl = style_cache_ttl
+    
+    styles = get_cached_style(style_id, ttl)
+    if styles is not None:
+        return styles
+    
+    with style_cache_lock:
+        style_lock = style_load_locks.setdefault(style_id, threading.Lock())
+    
+    with style_lock:
+        # 기다리는 동안 다른 스레드가 받아 두었을 수 있음
+        styles = get_cached_style(style_id, ttl)
+        if styles is not None:
+            return styles
+        
+        now = time.time()
+        cache_path = style_cache_path(style_id, style_cache_dir)
+        
+        if os.path.exists(cache_path) and now - os.path.getmtime(cache_path) < ttl:
+            try:
+                with open(cache_path, mode='r', encoding='utf-8') as f:
+                    styles = json.load(f)
+                validate_style(styles)
+            except ValueError:
+                pass
+            else:
+                with style_cache_lock:
+                    style_cache[style_id] = (styles, os.path.getmtime(cache_path))
+                return styles
+        
+        # Load styles
+        style_response = http_client.get(style_url.format(style_id), params = {'access_token': token})
+        styles = style_response.json()
+        
+        if style_response.status_code != 200:
+            if 'message' in styles:
+                raise MapBoxError(styles['message'])
+        
+        validate_style(styles)
+        
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, mode='w', encoding='utf-8') as f:
+            json.dump(styles, f, ensure_ascii=False)
+        
+        with style_cache_lock:
+            style_cache[style_id] = (styles, now)
+        
+        return styles
+
+def fetch_tile(tileset, token, x, y, zoom):
     # Load tilesets
-    tile_response = requests.get(tile_url.format(sources, zoom, x, y), params = {'access_token': token})
+    tile_response = http_client.get(tile_url.format(tileset, zoom, x, y), params = {'access_token': token})
+    
+    if tile_response.status_code == 404:
+        # 데이터가 없는 타일
+        return b''
+    
+    if tile_response.status_code != 200:
+        raise MapBoxError('Tile request failed ({}): {}/{}/{}'.format(tile_response.status_code, zoom, x, y))
+    
+    return tile_response.content
+
+def decode_tile(data):
+    return mapbox_vector_tile.decode(data)
 
-    tile = mapbox_vector_tile.decode(tile_response.content)
+def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None, styles = None, clip_rect = None, simplify_tolerance = None):
+    if styles is None:
+        styles = load_style(style_id, token)
+    
+    tile = decode_tile(fetch_tile(get_style_tileset(styles), token, x, y, zoom))
+    
+    return render_tile(tile, styles, zoom, draw_full_svg, clip_mask, fp, clip_rect, simplify_tolerance)
+
+def render_tile(tile, styles, zoom, draw_full_svg = True, clip_mask = True, fp = None, clip_rect = None, simplify_tolerance = None):
+    # 전역 상태 없이 인자로 받은 타일과 줌 레벨만 사용하므로 여러 스레드에서 동시에 호출 가능
+    # clip_rect(타일 좌표)가 있으면 그 밖의 피처는 버리고 걸치는 피처는 잘라서 그림
+    # simplify_tolerance(타일 좌표)가 있으면 면, 선 레이어의 꼭짓점을 그만큼 단순화함
+    prepared_geometries = {}
     
     if fp == None:
         f = io.StringIO()
@@ -395,73 +998,72 @@ def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = Tru
     else:
         f.write('<g id="map" transform="scale(1, -1) translate(0, -4096)">')
     
-    for layer in styles['layers']:
-        if 'minzoom' in layer:
-            if layer['minzoom'] > properties['zoom']:
-                continue
+    for layer in compile_style(styles, zoom):
+        paint = layer['paint']
+        layout = layer['layout']
         
         if layer['type'] == 'background':
-            if 'background-color' in layer['paint']:
-                fill = get_color(layer['paint']['background-color'])
-                f.write('<g id="{0}"><rect x="0" y="0" width="4096" height="4096" fill="{1}" stroke="{1}" stroke-width="32" /></g>'.format(layer['id'], fill))
+            if 'background-color' in paint:
+                fill = paint['background-color'](None)
+                
+                rect = (0, 0, 4096, 4096)
+                if clip_rect is not None:
+                    rect = intersect_rect(rect, clip_rect)
+                    if rect[0] >= rect[2] or rect[1] >= rect[3]:
+                        continue
+                
+                f.write('<g id="{0}"><rect x="{2}" y="{3}" width="{4}" height="{5}" fill="{1}" stroke="{1}" stroke-width="32" /></g>'.format(layer['id'], fill, rect[0], rect[1], rect[2] - rect[0], rect[3] - rect[1]))
         else:
             if not layer['source-layer'] in tile:
                 continue
             
             f.write('<g id="{}">'.format(layer['id']))
             source_layer = tile[layer['source-layer']]
+            layer_filter = layer['filter']
             
             for feature in source_layer['features']:
-                draw_filter = True
+                if layer_filter is not None and not layer_filter(feature):
+                    continue
                 
-                if 'filter' in layer:
-                    draw_filter = get_value(layer['filter'], feature)
+                if clip_rect is not None or simplify_tolerance:
+                    feature = prepare_feature(feature, clip_rect, simplify_tolerance, prepared_geometries)
+                    if feature is None:
+                        continue
                 
-                if draw_filter:
-                    if layer['type'] == 'fill':
-                        feature_style = {'fill': '#000000', 'opacity': 1}
-                        
-                        if 'paint' in layer:
-                            if 'fill-color' in layer['paint']:
-                                feature_style['fill'] = get_color(layer['paint']['fill-color'], feature)
-                            
-                            if 'opacity' in layer['paint']:
-                                feature_style['opacity'] = get_value(layer['paint']['opacity'], feature)
-                        
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'line':
-                        feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
-                        
-                        if 'paint' in layer:
-                            if 'line-color' in layer['paint']:
-                                feature_style['stroke'] = get_color(layer['paint']['line-color'], feature)
-                                
-                            if 'line-width' in layer['paint']:
-                                feature_style['stroke-width'] = get_value(layer['paint']['line-width'], feature) * 8
-                            
-                            if 'line-opacity' in layer['paint']:
-                                feature_style['stroke-opacity'] = get_value(layer['paint']['line-opacity'], feature)
-                            
-                            if 'line-dasharray' in layer['paint']:
-                                if not isinstance(layer['paint']['line-dasharray'], list):
-                                    raise TypeError()
-                                
-                                dasharray_str = ''
-                                for dash in layer['paint']['line-dasharray']:
-                                    dasharray_str += '{} '.format(dash)
-                                    
-                                feature_style['stroke-dasharray'] = dasharray_str
+                if layer['type'] == 'fill':
+                    feature_style = {'fill': '#000000', 'opacity': 1}
+                    
+                    if 'fill-color' in paint:
+                        feature_style['fill'] = paint['fill-color'](feature)
+                    
+                    if 'opacity' in paint:
+                        feature_style['opacity'] = paint['opacity'](feature)
+                    
+                    draw_geometry(f, feature, feature_style)
+                elif layer['type'] == 'line':
+                    feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
+                    
+                    if 'line-color' in paint:
+                        feature_style['stroke'] = paint['line-color'](feature)
                         
-                        if 'layout' in layer:
-                            if 'line-cap' in layer['layout']:
-                                feature_style['stroke-linecap'] = get_value(layer['layout']['line-cap'], feature)
-                                
-                            if 'line-join' in layer['layout']:
-                                feature_style['stroke-linejoin'] = get_value(layer['layout']['line-join'], feature)
+                    if 'line-width' in paint:
+                        feature_style['stroke-width'] = paint['line-width'](feature) * 8
+                    
+                    if 'line-opacity' in paint:
+                        feature_style['stroke-opacity'] = paint['line-opacity'](feature)
+                    
+                    if 'line-dasharray' in paint:
+                        feature_style['stroke-dasharray'] = paint['line-dasharray'](feature)
+                    
+                    if 'line-cap' in layout:
+                        feature_style['stroke-linecap'] = layout['line-cap'](feature)
                         
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'symbol':
-                        draw_symbol(f, feature, layer['layout'], layer['paint'])
+                    if 'line-join' in layout:
+                        feature_style['stroke-linejoin'] = layout['line-join'](feature)
+                    
+                    draw_geometry(f, feature, feature_style)
+                elif layer['type'] == 'symbol':
+                    draw_symbol(f, feature, layout, paint)
             
             f.write('</g>')
     
@@ -0,0 +1,79 @@
+import numpy as np
+
+# 버스 API에서 받아 노선도 렌더링까지 그대로 넘기는 데이터 형식
+
+class BusStop():
+    # 노선의 정류장 하나 (pos는 (경도, 위도))
+    __slots__ = ('arsid', 'name', 'pos', 'is_trans', 'updown_cd')
+    
+    def __init__(self, arsid, name, pos, is_trans = False, updown_cd = None):
+        self.arsid = arsid
+        self.name = name
+        self.pos = pos
+        self.is_trans = is_trans
+        self.updown_cd = updown_cd
+    
+    def __repr__(self):
+        return 'BusStop({!r}, {!r}, {!r}, is_trans={!r})'.format(self.arsid, self.name, self.pos, self.is_trans)
+    
+    def __eq__(self, other):
+        if not isinstance(other, BusStop):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+    
+    def to_dict(self):
+        return {'arsid': self.arsid, 'name': self.name, 'pos': list(self.pos), 'is_trans': self.is_trans, 'updown_cd': self.updown_cd}
+    
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d.get('arsid'), d['name'], tuple(d['pos']), d.get('is_trans', False), d.get('updown_cd'))
+
+class RenderStop():
+    # 노선도에 그릴 정류장 (pos는 투영된 좌표, ord는 bus_stops에서의 순번)
+    # text_dir이 None이면 정류장 명칭 방향을 자동으로 정함
+    __slots__ = ('ord', 'pos', 'name', 'section', 'is_pass', 'text_dir')
+    
+    def __init__(self, ord, pos, name, section, is_pass, text_dir = None):
+        self.ord = ord
+        self.pos = pos
+        self.name = name
+        self.section = section
+        self.is_pass = is_pass
+        self.text_dir = text_dir
+    
+    def __repr__(self):
+        return 'RenderStop({!r}, {!r}, {!r}, section={!r})'.format(self.ord, self.pos, self.name, self.section)
+
+class RouteGeometry():
+    # 노선형상 좌표를 (N, 2) float64 배열(경도, 위도)로 보관
+    # np.asarray로 바로 배열을 얻을 수 있어 convert_pos_array 등에 그대로 넘길 수 있음
+    __slots__ = ('array',)
+    
+    def __init__(self, points = ()):
+        self.array = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    
+    def __len__(self):
+        return len(self.array)
+    
+    def __iter__(self):
+        return iter(map(tuple, self.array.tolist()))
+    
+    def __array__(self, dtype = None, copy = None):
+        if dtype is None:
+            return self.array
+        return self.array.astype(dtype)
+    
+    def __eq__(self, other):
+        if not isinstance(other, RouteGeometry):
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+    
+    def __repr__(self):
+        return 'RouteGeometry({} points)'.format(len(self.array))
+    
+    def to_dict(self):
+        return {'points': self.array.tolist()}
+    
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['points'])
@@ -0,0 +1,124 @@
+import os, re, time, sqlite3, threading
+
+# 노선번호에서 처음 나오는 숫자 부분 (예: N62 -> 62, 강남01 -> 01)
+rx_route_number = re.compile(r'[0-9]+')
+
+def route_number(name):
+    match = rx_route_number.search(name or '')
+    return match[0] if match else None
+
+def prefix_range(prefix):
+    # prefix로 시작하는 문자열의 범위 [prefix, upper)
+    return prefix, prefix + '\U0010ffff'
+
+class RouteCatalog():
+    # 제공자/도시별로 받아 둔 노선 목록을 SQLite 파일에 저장하는 로컬 카탈로그
+    # 노선명과 노선번호(숫자 부분)의 접두어 인덱스로 검색하며, 수집 검색어별로 갱신 시각을 기록함
+    def __init__(self, path, ttl=7 * 24 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        
+        self.lock = threading.Lock()
+        self.initialized = False
+    
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(self.path, timeout=10)
+        
+        with self.lock:
+            if not self.initialized:
+                with conn:
+                    conn.execute('CREATE TABLE IF NOT EXISTS routes (id TEXT PRIMARY KEY, name TEXT NOT NULL, number TEXT, type INTEGER, desc TEXT, region TEXT, updated REAL)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS routes_name ON routes (name)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS routes_number ON routes (number)')
+                    conn.execute('CREATE TABLE IF NOT EXISTS harvests (query TEXT PRIMARY KEY, updated REAL)')
+                self.initialized = True
+        
+        return conn
+    
+    def upsert(self, bus_info_list, region_func=None):
+        now = time.time()
+        rows = []
+        for bus in bus_info_list:
+            region = region_func(bus['type'], bus['id']) if region_func else None
+            rows.append((bus['id'], bus['name'], route_number(bus['name']), bus['type'], bus['desc'], region, now))
+        
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO routes (id, name, number, type, desc, region, updated) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+    
+    def search(self, text, limit=None):
+        # 노선명 또는 노선번호가 text로 시작하는 노선
+        if not text:
+            return []
+        
+        lower, upper = prefix_range(text)
+        query = 'SELECT id, name, type, desc FROM routes WHERE (name >= ? AND name < ?) OR (number >= ? AND number < ?)'
+        params = [lower, upper, lower, upper]
+        
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        conn = self.connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        
+        return [{'name': name, 'id': route_id, 'desc': desc, 'type': route_type} for route_id, name, route_type, desc in rows]
+    
+    def mark_harvested(self, query):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO harvests (query, updated) VALUES (?, ?)', (query, time.time()))
+        finally:
+            conn.close()
+    
+    def is_harvested(self, query):
+        # query로 수집한 지 ttl이 지나지 않았는지 확인
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT updated FROM harvests WHERE query = ?', (query,)).fetchone()
+        finally:
+            conn.close()
+        
+        return row is not None and time.time() - row[0] <= self.ttl
+    
+    def is_fresh(self, queries):
+        # 모든 query가 ttl 안에 수집되었는지 쿼리 한 번으로 확인
+        queries = set(queries)
+        if not queries:
+            return True
+        
+        conn = self.connect()
+        try:
+            count = conn.execute('SELECT COUNT(*) FROM harvests WHERE query IN ({}) AND updated >= ?'.format(', '.join(['?'] * len(queries))),
+                                 list(queries) + [time.time() - self.ttl]).fetchone()[0]
+        finally:
+            conn.close()
+        
+        return count == len(queries)
+    
+    def count(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM routes').fetchone()[0]
+        finally:
+            conn.close()
+    
+    def clear(self):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM routes')
+                conn.execute('DELETE FROM harvests')
+        finally:
+            conn.close()
@@ -1,6 +1,10 @@
-import re, math, html
+import re, math, html, threading
+from functools import lru_cache
+import numpy as np
 from PIL import ImageFont
 from matplotlib import font_manager
+from spatial import GridIndex
+from models import RenderStop
 import os
 
 origin_tile = (3490, 1584)
@@ -64,10 +68,9 @@ class Mapframe():
     
     @classmethod
     def from_points(cls, points):
-        left = min(x for x, _ in points)
-        right = max(x for x, _ in points)
-        top = min(y for _, y in points)
-        bottom = max(y for _, y in points)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        left, top = points.min(axis=0).tolist()
+        right, bottom = points.max(axis=0).tolist()
         
         return cls(left, top, right, bottom)
 
@@ -103,6 +106,28 @@ def convert_gps(pos):
     
     return (lon_deg, lat_deg)
 
+def convert_pos_array(positions):
+    # (N, 2) 경위도 배열을 한 번에 투영
+    pos = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    n = 1 << 12
+    
+    result = np.empty_like(pos)
+    result[:, 0] = ((pos[:, 0] + 180.0) / 360.0 * n - origin_tile[0]) * 512
+    result[:, 1] = ((1.0 - np.arcsinh(np.tan(np.radians(pos[:, 1]))) / np.pi) / 2.0 * n - origin_tile[1]) * 512
+    
+    return result
+
+def convert_gps_array(positions):
+    # convert_pos_array의 역변환
+    pos = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    n = 1 << 12
+    
+    result = np.empty_like(pos)
+    result[:, 0] = (pos[:, 0] / 512 + origin_tile[0]) / n * 360.0 - 180.0
+    result[:, 1] = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (pos[:, 1] / 512 + origin_tile[1]) / n))))
+    
+    return result
+
 def distance(pos1, pos2):
     return math.sqrt((pos2[0] - pos1[0]) ** 2 + (pos2[1] - pos1[1]) ** 2)
     
@@ -162,14 +187,34 @@ def find_font_file(font_style):
         fp = font_manager.FontProperties(family='Arial')
         font_path = font_manager.findfont(fp, fallback_to_default=True)
     return font_path
+
+# 글꼴 스타일(family, weight 등)별로 폰트 파일 탐색과 FreeType 로딩은 한 번만 수행
+font_metrics_size = 72
+text_width_cache_size = 4096
+
+fonts = {}
+fonts_lock = threading.Lock()
+
+def font_key(font_style):
+    return tuple(sorted(font_style.items()))
+
+def load_font(key):
+    if key in fonts:
+        return fonts[key]
     
-def get_text_width(text, font_style):
-    font_file = find_font_file(font_style)
+    with fonts_lock:
+        if key not in fonts:
+            font_file = find_font_file(dict(key))
+            fonts[key] = ImageFont.truetype(font_file, font_metrics_size) if font_file else None
+    
+    return fonts[key]
 
-    if font_file:
-        font = ImageFont.truetype(font_file, 72)
-        if font:
-            return font.getlength(text) / 72
+@lru_cache(maxsize=text_width_cache_size)
+def measure_text(text, key):
+    font = load_font(key)
+    
+    if font:
+        return font.getlength(text) / font_metrics_size
     
     result = 0
     
@@ -185,6 +230,9 @@ def get_text_width(text, font_style):
     
     return result
 
+def get_text_width(text, font_style):
+    return measure_text(text, font_key(font_style))
+
 def check_collision(r1, r2):
     if r1[0] < r2[0] + r2[2] and r1[0] + r1[2] > r2[0] and r1[1] < r2[1] + r2[3] and r1[1] + r1[3] > r2[1]:
         if r2[0] > r1[0]:
@@ -228,15 +276,98 @@ def min_distance_from_segments(pos, points):
     
     return min_dist
 
+class RouteIndex():
+    # 노선 경로의 점과 선분에 대한 격자 인덱스 (RouteMap마다 한 번 생성)
+    # start, end는 points[start:end] 범위로 검색을 제한함
+    def __init__(self, points):
+        self.points = [(x, y) for x, y in np.asarray(points, dtype=np.float64).reshape(-1, 2).tolist()]
+        
+        length = 0
+        for i in range(len(self.points) - 1):
+            length += distance(self.points[i], self.points[i+1])
+        
+        # 셀 하나에 평균 선분 두어 개가 들어가도록 크기를 정함
+        cell_size = 2 * length / max(len(self.points) - 1, 1)
+        if cell_size <= 0:
+            cell_size = 1
+        
+        self.point_grid = GridIndex(cell_size)
+        self.segment_grid = GridIndex(cell_size)
+        
+        for i, p in enumerate(self.points):
+            self.point_grid.insert_point(i, p)
+        
+        for i in range(len(self.points) - 1):
+            self.segment_grid.insert_segment(i, self.points[i], self.points[i+1])
+    
+    def index_range(self, start, end):
+        start, end, _ = slice(start, end).indices(len(self.points))
+        
+        if start >= end:
+            raise IndexError("empty point range")
+        
+        return start, end
+    
+    def nearest_point(self, pos, start = None, end = None):
+        # find_nearest_point(pos, points[start:end]) + start 와 같은 결과
+        start, end = self.index_range(start, end)
+        points = self.points
+        
+        def dist_func(i):
+            if start <= i < end:
+                return distance(points[i], pos)
+            return None
+        
+        # 주변 셀이 비어 있어 격자 탐색이 범위 내 점 개수보다 오래 걸리면 전체 탐색
+        result = self.point_grid.nearest(pos, dist_func, max_cells = end - start)
+        if result is None:
+            return find_nearest_point(pos, points[start:end]) + start
+        
+        return result[1]
+    
+    def min_distance_to_segments(self, pos, start = None, end = None):
+        # min_distance_from_segments(pos, points[start:end]) 와 같은 결과
+        start, end = self.index_range(start, end)
+        points = self.points
+        
+        def dist_func(i):
+            if start <= i and i + 1 < end:
+                return distance_from_segment(pos, points[i], points[i+1])
+            return None
+        
+        result = self.segment_grid.nearest(pos, dist_func, max_cells = end - start)
+        if result is None:
+            return min_distance_from_segments(pos, points[start:end])
+        
+        return min(distance(pos, points[start]), result[0])
+    
+    def segments_within(self, pos, radius, start = None, end = None):
+        # min_distance_from_segments(pos, points[start:end]) <= radius 와 같은 결과
+        # 가장 가까운 거리를 구하지 않고 radius 안의 선분을 하나 찾으면 바로 끝냄
+        start, end = self.index_range(start, end)
+        points = self.points
+        
+        if distance(pos, points[start]) <= radius:
+            return True
+        
+        def pred(i):
+            return start <= i and i + 1 < end and distance_from_segment(pos, points[i], points[i+1]) <= radius
+        
+        return self.segment_grid.exists(pos[0] - radius, pos[1] - radius, pos[0] + radius, pos[1] + radius, pred)
+    
+    def points_in_rect(self, left, top, right, bottom):
+        # 사각형과 겹칠 수 있는 점 번호 (오름차순)
+        return self.point_grid.query(left, top, right, bottom)
+
 def get_bus_stop_name(bus_stop):
-    if bus_stop['name'] == '4.19민주묘지역': # 역명에 마침표가 있는 유일한 경우
+    if bus_stop.name == '4.19민주묘지역': # 역명에 마침표가 있는 유일한 경우
         return '4.19민주묘지역', True
     
-    name_split = bus_stop['name'].split('.')
-    name = bus_stop['name']
+    name_split = bus_stop.name.split('.')
+    name = bus_stop.name
     
     # 중앙차로 정류장 괄호 제거
-    match = rx_centerstop.search(bus_stop['name'])
+    match = rx_centerstop.search(bus_stop.name)
     if match:
         name = name[:match.start(0)]
         
@@ -335,10 +466,14 @@ class RouteMap():
     def __init__(self, route_info, bus_stops, points, is_one_way = False, theme = 'light'):
         self.route_info = route_info
         self.bus_stops = bus_stops
-        self.points = points
+        self.points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+        
+        # 정류장 좌표는 한 번만 투영해 둠
+        self.stop_positions = [(x, y) for x, y in convert_pos_array([stop.pos for stop in self.bus_stops]).tolist()]
         
         self.is_one_way = is_one_way
         self.mapframe = Mapframe.from_points(self.points)
+        self.route_index = RouteIndex(self.points)
         
         self.update_trans_id(self.get_trans_id())
         self.line_color, self.line_dark_color = get_bus_color(self.route_info)
@@ -346,7 +481,7 @@ class RouteMap():
 
     def get_trans_id(self):
         for i, stop in enumerate(self.bus_stops):
-            if stop['is_trans']:
+            if stop.is_trans:
                 return i
         
         return None
@@ -365,7 +500,7 @@ class RouteMap():
             new_id = len(self.bus_stops) - 1
     
         self.trans_id = new_id
-        self.t_point = find_nearest_point(convert_pos(self.bus_stops[self.trans_id]['pos']), self.points)
+        self.t_point = self.route_index.nearest_point(self.stop_positions[self.trans_id])
 
     def parse_bus_stops(self, min_interval):
         # 버스 정류장 렌더링
@@ -381,11 +516,11 @@ class RouteMap():
             name, is_main = get_bus_stop_name(self.bus_stops[i])
             bus_stop_name_list.append(name)
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
-            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
+            pos = self.stop_positions[i]
+            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i].name))
             section = 1 if i > self.trans_id else 0
             
-            main_stop_list.append({'ord': i, 'pos': pos, 'name': name, 'section': section, 'pass': pass_stop})
+            main_stop_list.append(RenderStop(i, pos, name, section, pass_stop))
         
         # 주요 정류장 처리
         for i in range(len(self.bus_stops)):
@@ -395,38 +530,45 @@ class RouteMap():
             
             bus_stop_name_list.append(name)
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
-            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
+            pos = self.stop_positions[i]
+            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i].name))
             section = 1 if i > self.trans_id else 0
             
             if section == 1:
-                min_path_dist = min_distance_from_segments(pos, self.points[:self.t_point])
+                min_path_dist = self.route_index.min_distance_to_segments(pos, 0, self.t_point)
                 if min_path_dist < min_interval / 8:
                     section = 0
             
-            main_stop_list.append({'ord': i, 'pos': pos, 'name': name, 'section': section, 'pass': pass_stop})
+            main_stop_list.append(RenderStop(i, pos, name, section, pass_stop))
             
-        main_stop_ids = [x['ord'] for x in main_stop_list]
+        main_stop_ids = [x.ord for x in main_stop_list]
+        
+        # 이미 표시하기로 한 정류장 위치 인덱스 (min_interval 이내의 정류장만 확인하면 됨)
+        stop_points = [s.pos for s in main_stop_list]
+        stop_grid = GridIndex(max(min_interval, 1e-6))
+        for i, p in enumerate(stop_points):
+            stop_grid.insert_point(i, p)
     
         # 비주요 정류장 처리
         for i in range(len(self.bus_stops)):
             if i in main_stop_ids:
                 continue
             
-            pos = convert_pos(self.bus_stops[i]['pos'])
-            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i]['name']))
+            pos = self.stop_positions[i]
+            pass_stop = bool(rx_pass_stop.search(self.bus_stops[i].name))
             section = 1 if i > self.trans_id else 0
             
-            stop_points = [s['pos'] for s in main_stop_list + minor_stop_list]
-            min_dist = min_distance_from_points(pos, stop_points)
+            min_dist = stop_grid.nearest(pos, lambda j: distance(pos, stop_points[j]), min_interval)[0]
             
             if i > self.trans_id:
-                min_path_dist = min_distance_from_segments(pos, self.points[:self.t_point])
+                min_path_dist = self.route_index.min_distance_to_segments(pos, 0, self.t_point)
                 if min_path_dist < min_interval / 4:
                     continue
             
             if min_dist > min_interval:
-                minor_stop_list.append({'ord': i, 'pos': pos, 'name': self.bus_stops[i]['name'], 'section': section, 'pass': pass_stop})
+                minor_stop_list.append(RenderStop(i, pos, self.bus_stops[i].name, section, pass_stop))
+                stop_grid.insert_point(len(stop_points), pos)
+                stop_points.append(pos)
         
         return main_stop_list + minor_stop_list
 
@@ -501,10 +643,10 @@ class RouteMap():
         style_circle = "stroke:{};".format(self.line_color) + style_circle_base
         style_circle_dark = "stroke:{};".format(self.line_dark_color) + style_circle_base
         
-        section = 0 if stop['section'] == 0 or self.is_one_way else 1
+        section = 0 if stop.section == 0 or self.is_one_way else 1
         
-        stop_circle_style = ((style_fill_gray if stop['pass'] else style_fill_circle) if self.route_info['name'][0] != 'N' else style_fill_yellow) + (style_circle if section == 0 else style_circle_dark)
-        svg_circle = '<circle style="{}" cx="{}" cy="{}" r="{}" />\n'.format(stop_circle_style, stop['pos'][0], stop['pos'][1], 6 * size_factor)
+        stop_circle_style = ((style_fill_gray if stop.is_pass else style_fill_circle) if self.route_info['name'][0] != 'N' else style_fill_yellow) + (style_circle if section == 0 else style_circle_dark)
+        svg_circle = '<circle style="{}" cx="{}" cy="{}" r="{}" />\n'.format(stop_circle_style, stop.pos[0], stop.pos[1], 6 * size_factor)
         
         return svg_circle
     
@@ -513,14 +655,14 @@ class RouteMap():
         style_fill_gray = "fill:#cccccc;"
         style_text = "font-weight:bold;font-size:30px;line-height:1.0;font-family:'KoPubDotum';text-align:start;letter-spacing:0px;word-spacing:0px;fill-opacity:1;"
         
-        section = 0 if stop['section'] == 0 or self.is_one_way else 1
+        section = 0 if stop.section == 0 or self.is_one_way else 1
         
         if section == 0:
-            stop_p = find_nearest_point(stop['pos'], self.points[:self.t_point])
+            stop_p = self.route_index.nearest_point(stop.pos, 0, self.t_point)
         else:
-            stop_p = find_nearest_point(stop['pos'], self.points[self.t_point:]) + self.t_point
+            stop_p = self.route_index.nearest_point(stop.pos, self.t_point)
         
-        stop_p_prev, stop_p_next = get_point_segment(self.points, stop_p, stop_p, 10 * size_factor)
+        stop_p_prev, stop_p_next = get_point_segment(self.route_index.points, stop_p, stop_p, 10 * size_factor)
         
         path_dir = (self.points[stop_p_next][0] - self.points[stop_p_prev][0], self.points[stop_p_next][1] - self.points[stop_p_prev][1])
         normal_dir = (path_dir[1], -path_dir[0])
@@ -538,42 +680,42 @@ class RouteMap():
         text_size_factor = size_factor * 0.56
         text_height = 30 * text_size_factor
         
-        match = rx_pass_stop.search(stop['name'])
+        match = rx_pass_stop.search(stop.name)
         if match:
-            stop_name_main = stop['name'][:match.start(0)]
-            stop_name_suffix = stop['name'][match.start(0):]
+            stop_name_main = stop.name[:match.start(0)]
+            stop_name_suffix = stop.name[match.start(0):]
         else:
-            stop_name_main = stop['name']
+            stop_name_main = stop.name
             stop_name_suffix = ''
 
         text_width = (get_text_width(stop_name_main, {'family': 'KoPubDotum', 'weight': 'bold'}) * 30 + get_text_width(stop_name_suffix, {'family': 'KoPubDotum', 'weight': 'bold'}) * 24 + 30)
         text_offset = 0
 
-        if stop['ord'] == 0:
+        if stop.ord == 0:
             text_offset = 40 * text_size_factor
         
-        text_pos_right = (stop['pos'][0] + 16 * normal_dir[0] * size_factor,  stop['pos'][1] + 16 * normal_dir[1] * size_factor - text_height / 2)
+        text_pos_right = (stop.pos[0] + 16 * normal_dir[0] * size_factor,  stop.pos[1] + 16 * normal_dir[1] * size_factor - text_height / 2)
         text_rect_right = (text_pos_right[0], text_pos_right[1], text_width * text_size_factor + text_offset, text_height)
         
-        text_pos_left = (stop['pos'][0] - 16 * normal_dir[0] * size_factor - text_width * text_size_factor - text_offset, stop['pos'][1] - 16 * normal_dir[1] * size_factor - text_height / 2)
+        text_pos_left = (stop.pos[0] - 16 * normal_dir[0] * size_factor - text_width * text_size_factor - text_offset, stop.pos[1] - 16 * normal_dir[1] * size_factor - text_height / 2)
         text_rect_left = (text_pos_left[0], text_pos_left[1], text_width * text_size_factor + text_offset, text_height)
 
         if normal_dir[1] > 0:
             normal_dir = (-normal_dir[0], -normal_dir[1])
         
-        text_pos_up = (stop['pos'][0] - text_width * text_size_factor / 2, stop['pos'][1] - 25 * size_factor - text_height / 2)
+        text_pos_up = (stop.pos[0] - text_width * text_size_factor / 2, stop.pos[1] - 25 * size_factor - text_height / 2)
         text_rect_up = (text_pos_up[0], text_pos_up[1], text_width * text_size_factor, text_height)
         
-        text_pos_down = (stop['pos'][0] - text_width * text_size_factor / 2, stop['pos'][1] + 25 * size_factor - text_height / 2)
+        text_pos_down = (stop.pos[0] - text_width * text_size_factor / 2, stop.pos[1] + 25 * size_factor - text_height / 2)
         text_rect_down = (text_pos_down[0], text_pos_down[1], text_width * text_size_factor, text_height)
         
         text_pos_list = [text_pos_up, text_pos_down, text_pos_left, text_pos_right]
         text_rect_list = [text_rect_up, text_rect_down, text_rect_left, text_rect_right]
         
         if direction == -1:
-            collisions = [get_collision_score(x, self.text_rects, self.points) for x in text_rect_list]
+            collisions = [self.get_collision_score(x) for x in text_rect_list]
 
-            if stop['ord'] == 0:
+            if stop.ord == 0:
                 direction = 2
                 if collisions[2] >= collisions[3]:
                     direction = 3
@@ -590,6 +732,10 @@ class RouteMap():
         text_pos = text_pos_list[direction]
         text_rect = text_rect_list[direction]
         
+        if self.text_grid is None:
+            # 정류장 명칭 박스 몇 개가 한 셀에 들어가는 정도의 크기
+            self.text_grid = GridIndex(text_height * 8)
+        self.text_grid.insert(len(self.text_rects), text_rect[0], text_rect[1], text_rect[0] + text_rect[2], text_rect[1] + text_rect[3])
         self.text_rects.append(text_rect)
             
         stop_name_svg = escape_svg_text(stop_name_main)
@@ -600,7 +746,7 @@ class RouteMap():
         depot_text_offset = 0
 
         # 기점 표시
-        if stop['ord'] == 0:
+        if stop.ord == 0:
             dir_len = math.sqrt(path_dir[0] ** 2 + path_dir[1] ** 2)
             if dir_len == 0:
                 dir_cos = 1
@@ -622,9 +768,9 @@ class RouteMap():
             svg_text += '</g>\n'
 
         svg_text += '<rect style="fill:{};fill-opacity:1;stroke:none;" width="{:.2f}" height="36" x="{:.2f}" y="0" ry="18" />'.format(self.line_color if section == 0 else self.line_dark_color, text_width, depot_text_offset)
-        svg_text += '<text style="{}" text-anchor="middle" x="{:.2f}" y="28">{}</text>\n'.format(style_text + (style_fill_gray if stop['pass'] else style_fill_white), text_width / 2 + depot_text_offset, stop_name_svg)
+        svg_text += '<text style="{}" text-anchor="middle" x="{:.2f}" y="28">{}</text>\n'.format(style_text + (style_fill_gray if stop.is_pass else style_fill_white), text_width / 2 + depot_text_offset, stop_name_svg)
 
-        svg_text = '<g id="stop{3}" transform="translate({0:.2f}, {1:.2f}) scale({2:.2f}, {2:.2f})">'.format(text_pos[0], text_pos[1], text_size_factor, stop['ord']) + svg_text + '</g>'
+        svg_text = '<g id="stop{3}" transform="translate({0:.2f}, {1:.2f}) scale({2:.2f}, {2:.2f})">'.format(text_pos[0], text_pos[1], text_size_factor, stop.ord) + svg_text + '</g>'
         
         self.mapframe.update_rect(text_rect)
             
@@ -638,8 +784,8 @@ class RouteMap():
         
         path_points = []
         
-        start_point = find_nearest_point(convert_pos(self.bus_stops[0]['pos']), self.points[:self.t_point])
-        end_point = find_nearest_point(convert_pos(self.bus_stops[-1]['pos']), self.points[self.t_point:]) + self.t_point
+        start_point = self.route_index.nearest_point(self.stop_positions[0], 0, self.t_point)
+        end_point = self.route_index.nearest_point(self.stop_positions[-1], self.t_point)
         
         path_points.append(self.points[start_point:self.t_point+1])
         
@@ -655,14 +801,17 @@ class RouteMap():
         segment_start = 0
         segment_end = -1
         
+        route_points = self.route_index.points
+        
         for i in range(self.t_point, end_point):
-            min_dist = min_distance_from_segments(self.points[i], path_points[0])
-            if min_dist > skip_threshold and i < end_point - 1:
+            # 가는 방향 경로에서 skip_threshold보다 멀리 떨어진 구간만 따로 그림
+            is_diverged = not self.route_index.segments_within(route_points[i], skip_threshold, start_point, self.t_point + 1)
+            if is_diverged and i < end_point - 1:
                 if segment_end < 0:
                     segment_start = i
                 segment_end = i
             elif segment_end >= 0:
-                path_segment = get_point_segment(self.points, segment_start, segment_end, skip_threshold * 2)
+                path_segment = get_point_segment(route_points, segment_start, segment_end, skip_threshold * 2)
                 path_points.append(self.points[path_segment[0]:min(path_segment[1]+1, end_point)])
                 segment_end = -1
         
@@ -678,8 +827,26 @@ class RouteMap():
         
         return svg_path
     
+    def get_collision_score(self, new_rect):
+        # get_collision_score(new_rect, self.text_rects, points)와 같은 결과
+        # 격자에서 겹칠 수 있는 후보만 골라 원래와 같은 순서로 더함
+        left, top, right, bottom = new_rect[0], new_rect[1], new_rect[0] + new_rect[2], new_rect[1] + new_rect[3]
+        collision = 0
+        
+        if self.text_grid is not None:
+            for i in self.text_grid.query(left, top, right, bottom):
+                collision += check_collision(self.text_rects[i], new_rect)
+        
+        points = self.route_index.points
+        for i in self.route_index.points_in_rect(left - 2, top - 2, right + 2, bottom + 2):
+            p = points[i]
+            collision += 4 * check_collision((p[0] - 2, p[1] - 2, 4, 4), new_rect)
+        
+        return collision
+    
     def render_init(self):
         self.text_rects = []
+        self.text_grid = None
     
     def render(self, size_factor, min_interval):
         self.render_init()
@@ -72,18 +72,10 @@ def main():
     
     print('노선 정보 불러오는 중...')
     try:
-        if route_data['type'] <= 10:
-            bus_stops = bus_api.get_seoul_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_seoul_bus_route(key, route_data['id'])
-            route_info = bus_api.get_seoul_bus_type(key, route_data['id'])
-        elif route_data['type'] <= 60:
-            bus_stops = bus_api.get_gyeonggi_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_gyeonggi_bus_route(key, route_data['id'])
-            route_info = bus_api.get_gyeonggi_bus_type(key, route_data['id'])
-        else:
-            route_positions, route_bims_id = bus_api.get_busan_bus_route(route_data['name'])
-            bus_stops = bus_api.get_busan_bus_stops(key, route_data['id'], route_bims_id)
-            route_info = bus_api.get_busan_bus_type(key, route_bims_id)
+        route = bus_api.load_route(key, route_data)
+        bus_stops = route['bus_stops']
+        route_positions = route['route_positions']
+        route_info = route['route_info']
     except requests.exceptions.ConnectTimeout:
         print('Request Timeout')
         return
@@ -94,10 +86,7 @@ def main():
     draw_full_svg = True
     draw_background_map = True
 
-    points = []
-
-    for pos in route_positions:
-        points.append(convert_pos(pos))
+    points = convert_pos_array(route_positions)
     
     # 일방통행 여부 묻기
     if distance(points[0], points[-1]) > 50:
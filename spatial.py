@@ -0,0 +1,164 @@
+import math
+
+class GridIndex():
+    # 균일 격자 공간 인덱스
+    # 항목은 자신을 덮는 사각형 영역(left, top, right, bottom)이 걸치는 모든 셀에 등록됨
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+
+        self.cell_size = cell_size
+        self.cells = {}
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.cells)
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, item, left, top, right, bottom):
+        cx1, cy1 = self.cell(left, top)
+        cx2, cy2 = self.cell(right, bottom)
+
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    self.cells[(cx, cy)] = [item]
+                else:
+                    cell.append(item)
+
+        if self.bounds is None:
+            self.bounds = (cx1, cy1, cx2, cy2)
+        else:
+            self.bounds = (min(self.bounds[0], cx1), min(self.bounds[1], cy1), max(self.bounds[2], cx2), max(self.bounds[3], cy2))
+
+    def insert_point(self, item, pos):
+        self.insert(item, pos[0], pos[1], pos[0], pos[1])
+
+    def insert_segment(self, item, pos1, pos2):
+        # 긴 선분은 셀 크기 이하의 조각으로 나눠 조각별 외접 사각형에만 등록
+        length = math.sqrt((pos2[0] - pos1[0]) ** 2 + (pos2[1] - pos1[1]) ** 2)
+        pieces = max(1, math.ceil(length / self.cell_size))
+
+        prev = pos1
+        for i in range(1, pieces + 1):
+            t = i / pieces
+            cur = (pos1[0] + (pos2[0] - pos1[0]) * t, pos1[1] + (pos2[1] - pos1[1]) * t)
+            self.insert(item, min(prev[0], cur[0]), min(prev[1], cur[1]), max(prev[0], cur[0]), max(prev[1], cur[1]))
+            prev = cur
+
+    def query(self, left, top, right, bottom):
+        # 사각형 영역과 겹치는 셀에 등록된 항목 (중복 제거, 정렬된 순서)
+        cx1, cy1 = self.cell(left, top)
+        cx2, cy2 = self.cell(right, bottom)
+
+        items = set()
+
+        if self.bounds is None:
+            return []
+
+        cx1 = max(cx1, self.bounds[0])
+        cy1 = max(cy1, self.bounds[1])
+        cx2 = min(cx2, self.bounds[2])
+        cy2 = min(cy2, self.bounds[3])
+
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    items.update(cell)
+
+        return sorted(items)
+
+    def exists(self, left, top, right, bottom, pred):
+        # 사각형 영역과 겹치는 셀의 항목 중 pred(item)을 만족하는 것이 하나라도 있는지 확인
+        # 만족하는 항목을 찾는 즉시 탐색을 멈춤
+        if self.bounds is None:
+            return False
+
+        cx1, cy1 = self.cell(left, top)
+        cx2, cy2 = self.cell(right, bottom)
+
+        cx1 = max(cx1, self.bounds[0])
+        cy1 = max(cy1, self.bounds[1])
+        cx2 = min(cx2, self.bounds[2])
+        cy2 = min(cy2, self.bounds[3])
+
+        checked = set()
+
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    continue
+
+                for item in cell:
+                    if item in checked:
+                        continue
+                    checked.add(item)
+
+                    if pred(item):
+                        return True
+
+        return False
+
+    def ring(self, cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+
+        for x in range(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in range(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def nearest(self, pos, dist_func, max_dist = math.inf, max_cells = None):
+        # pos에서 가장 가까운 항목을 셀 고리(ring)를 넓혀가며 탐색
+        # dist_func(item)이 None을 반환하면 해당 항목은 제외
+        # 거리가 같으면 번호가 작은 항목을 반환
+        # max_cells개보다 많은 셀을 확인해야 하면 탐색을 포기하고 None을 반환
+        best_dist = math.inf
+        best_item = None
+
+        if self.bounds is None:
+            return best_dist, best_item
+
+        cx, cy = self.cell(pos[0], pos[1])
+        max_ring = max(abs(cx - self.bounds[0]), abs(cx - self.bounds[2]), abs(cy - self.bounds[1]), abs(cy - self.bounds[3]))
+        visited = set()
+
+        for r in range(max_ring + 1):
+            if max_cells is not None and (2 * r + 1) ** 2 > max_cells:
+                return None
+
+            for key in self.ring(cx, cy, r):
+                cell = self.cells.get(key)
+                if cell is None:
+                    continue
+
+                for item in cell:
+                    if item in visited:
+                        continue
+                    visited.add(item)
+
+                    dist = dist_func(item)
+                    if dist is None:
+                        continue
+
+                    if best_item is None or dist < best_dist or (dist == best_dist and item < best_item):
+                        best_dist = dist
+                        best_item = item
+
+            # r번째 고리 바깥의 항목은 모두 r * cell_size보다 멀리 있음
+            reach = r * self.cell_size
+            if best_dist < reach or reach > max_dist:
+                break
+
+        if best_dist > max_dist:
+            return math.inf, None
+
+        return best_dist, best_item
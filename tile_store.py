@@ -0,0 +1,229 @@
+import os, time, zlib, sqlite3, threading
+
+class TileStore():
+    # 배경 지도 타일을 SQLite 파일 하나에 저장하는 MBTiles 형식의 저장소
+    # 받은 벡터 타일(mvt)은 스타일과 관계없이 (tileset, z, x, y)로 vector_tiles 표에 저장해
+    # 같은 타일셋을 쓰는 스타일(밝은 테마, 어두운 테마 등)끼리 공유하고,
+    # 렌더링한 SVG 조각(svg)은 (style, z, x, y)로 tiles 표에 저장함
+    # svg는 단순화 허용 오차(simplify)가 같을 때만 다시 사용함
+    # compress가 True면 데이터를 zlib으로 압축 (파일을 처음 만들 때 정해져 metadata 표에 기록됨)
+    # 타일마다 스타일 수정 시각(revision)과 마지막 사용 시각(accessed)을 기록해
+    # 스타일이 바뀌면 그 스타일의 SVG 조각을 버리고, 전체 크기가 max_size를 넘으면 오래 쓰지 않은 타일부터 지움
+    def __init__(self, path, compress=True, max_size=512 * 1024 * 1024):
+        self.path = path
+        self.compress = compress
+        self.max_size = max_size
+        
+        self.lock = threading.Lock()
+        self.initialized = False
+        self.checked_revisions = {}
+    
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(self.path, timeout=10)
+        
+        with self.lock:
+            if not self.initialized:
+                # 지운 공간을 prune에서 파일에 돌려줄 수 있도록 새 파일은 incremental auto_vacuum으로 만듦
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                
+                with conn:
+                    conn.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+                    conn.execute('CREATE TABLE IF NOT EXISTS tiles (style TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, '
+                                 'svg BLOB NOT NULL, simplify INTEGER, revision TEXT, accessed REAL, size INTEGER NOT NULL, PRIMARY KEY (style, z, x, y))')
+                    conn.execute('CREATE TABLE IF NOT EXISTS vector_tiles (tileset TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, '
+                                 'mvt BLOB NOT NULL, accessed REAL, size INTEGER NOT NULL, PRIMARY KEY (tileset, z, x, y))')
+                    
+                    # 전체 데이터 크기는 트리거로 저장, 교체, 삭제할 때마다 store_size 표에 더하고 빼서
+                    # 쓸 때마다 모든 타일의 크기를 다시 더하지 않음
+                    conn.execute('CREATE TABLE IF NOT EXISTS store_size (total INTEGER NOT NULL)')
+                    conn.execute('INSERT INTO store_size (total) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM store_size)')
+                    for table in ('tiles', 'vector_tiles'):
+                        conn.execute('CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON {0} BEGIN UPDATE store_size SET total = total + new.size; END'.format(table))
+                        conn.execute('CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE OF size ON {0} BEGIN UPDATE store_size SET total = total + new.size - old.size; END'.format(table))
+                        conn.execute('CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON {0} BEGIN UPDATE store_size SET total = total - old.size; END'.format(table))
+                    
+                    conn.execute('CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS vector_tiles_accessed ON vector_tiles (accessed)')
+                    conn.execute('INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)', ('compression', 'zlib' if self.compress else 'none'))
+                    
+                    self.compress = conn.execute('SELECT value FROM metadata WHERE name = ?', ('compression',)).fetchone()[0] == 'zlib'
+                self.initialized = True
+        
+        return conn
+    
+    def pack(self, data):
+        if data is None:
+            return None
+        return zlib.compress(data) if self.compress else data
+    
+    def unpack(self, data):
+        if data is None:
+            return None
+        return zlib.decompress(data) if self.compress else bytes(data)
+    
+    def invalidate(self, style, revision):
+        # 다른 revision으로 저장된 style의 SVG 조각을 지움 (스타일 문서가 수정됨)
+        # 벡터 타일은 스타일과 관계없으므로 그대로 둠
+        if self.checked_revisions.get(style) == revision:
+            return
+        
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM tiles WHERE style = ? AND revision IS NOT ?', (style, revision))
+        finally:
+            conn.close()
+        
+        self.checked_revisions[style] = revision
+    
+    def get_tiles(self, style, revision, z, x1, y1, x2, y2):
+        # 타일 범위의 SVG 조각 전체를 쿼리 한 번으로 읽고 사용 시각을 갱신
+        # {(x, y): (svg, simplify)}
+        self.invalidate(style, revision)
+        
+        params = (style, z, x1, x2, y1, y2)
+        conn = self.connect()
+        try:
+            with conn:
+                rows = conn.execute('SELECT x, y, svg, simplify FROM tiles WHERE style = ? AND z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?', params).fetchall()
+                if rows:
+                    conn.execute('UPDATE tiles SET accessed = ? WHERE style = ? AND z = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?', (time.time(),) + params)
+        finally:
+            conn.close()
+        
+        return {(x, y): (self.unpack(svg).decode('utf-8'), simplify) for x, y, svg, simplify in rows}
+    
+    def get_vector_tiles(self, tileset, z, positions):
+        # positions [(x, y), ...] 의 벡터 타일을 읽고 사용 시각을 갱신
+        # {(x, y): mvt} (저장되지 않은 타일은 빠짐)
+        positions = list(positions)
+        now = time.time()
+        rows = []
+        
+        conn = self.connect()
+        try:
+            with conn:
+                # SQLite의 변수 개수 제한(이전 버전은 999개)을 넘지 않도록 나눠서 조회
+                for i in range(0, len(positions), 400):
+                    chunk = positions[i:i + 400]
+                    values = ', '.join(['(?, ?)'] * len(chunk))
+                    params = [tileset, z] + [v for position in chunk for v in position]
+                    
+                    rows += conn.execute('SELECT x, y, mvt FROM vector_tiles WHERE tileset = ? AND z = ? AND (x, y) IN (VALUES {})'.format(values), params).fetchall()
+                
+                conn.executemany('UPDATE vector_tiles SET accessed = ? WHERE tileset = ? AND z = ? AND x = ? AND y = ?',
+                                 [(now, tileset, z, x, y) for x, y, _ in rows])
+        finally:
+            conn.close()
+        
+        return {(x, y): self.unpack(mvt) for x, y, mvt in rows}
+    
+    def put_tiles(self, style, revision, z, tiles):
+        # tiles: [(x, y, svg, simplify), ...] 를 한 트랜잭션으로 저장하고, 크기 상한을 넘으면 정리함
+        now = time.time()
+        rows = []
+        for x, y, svg, simplify in tiles:
+            svg = self.pack(svg.encode('utf-8'))
+            rows.append((style, z, x, y, svg, simplify, revision, now, len(svg)))
+        
+        self.write('INSERT INTO tiles (style, z, x, y, svg, simplify, revision, accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                   'ON CONFLICT (style, z, x, y) DO UPDATE SET svg = excluded.svg, simplify = excluded.simplify, revision = excluded.revision, '
+                   'accessed = excluded.accessed, size = excluded.size', rows)
+    
+    def put_vector_tiles(self, tileset, z, tiles):
+        # tiles: [(x, y, mvt), ...] 를 한 트랜잭션으로 저장하고, 크기 상한을 넘으면 정리함
+        now = time.time()
+        rows = []
+        for x, y, mvt in tiles:
+            mvt = self.pack(mvt)
+            rows.append((tileset, z, x, y, mvt, now, len(mvt)))
+        
+        self.write('INSERT INTO vector_tiles (tileset, z, x, y, mvt, accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                   'ON CONFLICT (tileset, z, x, y) DO UPDATE SET mvt = excluded.mvt, accessed = excluded.accessed, size = excluded.size', rows)
+    
+    def write(self, sql, rows):
+        # 교체할 때 트리거가 이전 크기를 빼도록 INSERT OR REPLACE 대신 UPSERT를 사용함
+        if not rows:
+            return
+        
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany(sql, rows)
+                total = conn.execute('SELECT total FROM store_size').fetchone()[0]
+        finally:
+            conn.close()
+        
+        if self.max_size is not None and total > self.max_size:
+            self.prune()
+    
+    def prune(self, limit=None):
+        # SVG 조각과 벡터 타일을 함께 최근에 쓴 것부터 더해 limit(기본 max_size)를 넘는 나머지를 지움
+        # 지운 타일 수를 반환
+        if limit is None:
+            limit = self.max_size
+        
+        conn = self.connect()
+        try:
+            with conn:
+                rows = conn.execute('SELECT kind, id FROM (SELECT kind, id, SUM(size) OVER (ORDER BY accessed DESC, kind, id DESC) AS total FROM '
+                                    '(SELECT 0 AS kind, rowid AS id, size, accessed FROM tiles UNION ALL SELECT 1, rowid, size, accessed FROM vector_tiles)) '
+                                    'WHERE total > ?', (limit,)).fetchall()
+                
+                conn.executemany('DELETE FROM tiles WHERE rowid = ?', [(rowid,) for kind, rowid in rows if kind == 0])
+                conn.executemany('DELETE FROM vector_tiles WHERE rowid = ?', [(rowid,) for kind, rowid in rows if kind == 1])
+            
+            # execute로는 한 페이지만 반환되므로 executescript로 끝까지 실행
+            conn.executescript('PRAGMA incremental_vacuum;')
+        finally:
+            conn.close()
+        
+        return len(rows)
+    
+    def stats(self):
+        # SVG 조각(스타일별)과 벡터 타일(타일셋별)의 타일 수, 데이터 크기
+        conn = self.connect()
+        try:
+            style_rows = conn.execute('SELECT style, COUNT(*), COALESCE(SUM(size), 0), MIN(accessed) FROM tiles GROUP BY style').fetchall()
+            tileset_rows = conn.execute('SELECT tileset, COUNT(*), COALESCE(SUM(size), 0), MIN(accessed) FROM vector_tiles GROUP BY tileset').fetchall()
+        finally:
+            conn.close()
+        
+        try:
+            file_size = os.path.getsize(self.path)
+        except OSError:
+            file_size = 0
+        
+        return {
+            'tiles': sum(row[1] for row in style_rows),
+            'vector_tiles': sum(row[1] for row in tileset_rows),
+            'size': sum(row[2] for row in style_rows + tileset_rows),
+            'max_size': self.max_size,
+            'file_size': file_size,
+            'styles': {style: {'tiles': count, 'size': size, 'oldest_access': oldest} for style, count, size, oldest in style_rows},
+            'tilesets': {tileset: {'tiles': count, 'size': size, 'oldest_access': oldest} for tileset, count, size, oldest in tileset_rows},
+        }
+    
+    def clear(self, style=None):
+        # style을 지정하면 그 스타일의 SVG 조각만 지우고, 아니면 벡터 타일까지 모두 지움
+        conn = self.connect()
+        try:
+            with conn:
+                if style is None:
+                    conn.execute('DELETE FROM tiles')
+                    conn.execute('DELETE FROM vector_tiles')
+                else:
+                    conn.execute('DELETE FROM tiles WHERE style = ?', (style,))
+            
+            conn.executescript('PRAGMA incremental_vacuum;')
+        finally:
+            conn.close()
+        
+        if style is None:
+            self.checked_revisions.clear()
+        else:
+            self.checked_revisions.pop(style, None)
@@ -0,0 +1,94 @@
+import io, re, codecs
+
+# lxml이 설치되어 있으면 더 빠른 lxml의 iterparse를 사용
+try:
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+rx_xml_encoding = re.compile(br'^\s*<\?xml[^>]*encoding=', flags=re.IGNORECASE)
+rx_xml_declaration = re.compile(br'^\s*<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)["\'][^>]*\?>', flags=re.IGNORECASE)
+
+# expat이 직접 읽을 수 있는 인코딩
+expat_encodings = {'utf-8', 'utf-16', 'latin-1', 'iso8859-1', 'ascii'}
+
+# EUC-KR로 선언하고 실제로는 CP949(확장 완성형)로 보내는 서버가 있으므로(부산 BIMS 등) 상위 호환인 CP949로 디코딩
+encoding_aliases = {'euc_kr': 'cp949'}
+
+class XmlRecords():
+    # 응답 XML을 한 번 훑어 헤더 값과 항목(item) 레코드만 뽑아 둔 결과
+    # header: {경로: 텍스트} (경로는 루트 아래부터, 예: 'msgHeader/headerCd')
+    # items: [{자식 태그 또는 속성 이름: 텍스트}, ...]
+    __slots__ = ('header', 'items')
+    
+    def __init__(self, header, items):
+        self.header = header
+        self.items = items
+
+def lookup_encoding(name):
+    # 코덱 이름 (알 수 없는 인코딩이면 None)
+    try:
+        encoding = codecs.lookup(name).name
+    except LookupError:
+        return None
+    
+    return encoding_aliases.get(encoding, encoding)
+
+def response_bytes(response):
+    # XML 선언에 인코딩이 있으면 받은 바이트를 그대로 사용하고,
+    # 선언이 없고 헤더에 UTF-8이 아닌 문자셋이 있으면 requests가 디코딩한 문자열을 UTF-8로 다시 인코딩
+    content = response.content
+    if rx_xml_encoding.match(content):
+        return content
+    
+    content_type = response.headers.get('Content-Type', '').lower()
+    if 'charset=' in content_type and response.encoding:
+        encoding = lookup_encoding(response.encoding)
+        if encoding is not None and encoding != 'utf-8':
+            return content.decode(encoding, errors='replace').encode('utf-8')
+    
+    return content
+
+def to_expat_encoding(data):
+    # EUC-KR 등 expat이 지원하지 않는 인코딩으로 선언된 문서는 UTF-8로 바꿈
+    match = rx_xml_declaration.match(data)
+    if match is None:
+        return data
+    
+    encoding = lookup_encoding(match[1].decode('ascii'))
+    if encoding is None or encoding in expat_encodings:
+        return data
+    
+    return b'<?xml version="1.0" encoding="UTF-8"?>' + data[match.end():].decode(encoding, errors='replace').encode('utf-8')
+
+def parse_records(data, item_tag, header_paths=()):
+    # data(bytes 또는 requests 응답)를 iterparse로 읽으며
+    # item_tag 요소는 레코드(dict)로 바꾸고 바로 비워 메모리를 아낌
+    if not isinstance(data, (bytes, bytearray)):
+        data = response_bytes(data)
+    data = to_expat_encoding(data)
+    
+    header_paths = set(header_paths)
+    header = {}
+    items = []
+    path = []
+    
+    for event, elem in iterparse(io.BytesIO(data), events=('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            continue
+        
+        if elem.tag == item_tag:
+            record = dict(elem.attrib)
+            for child in elem:
+                record[child.tag] = child.text
+            items.append(record)
+            elem.clear()
+        elif header_paths:
+            elem_path = '/'.join(path[1:])
+            if elem_path in header_paths:
+                header[elem_path] = elem.text
+        
+        path.pop()
+    
+    return XmlRecords(header, items)